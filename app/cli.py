@@ -0,0 +1,123 @@
+# --- Headless entry point: python -m app.cli ---
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from app.core.config import Config, ConfigError
+from app.core.auth import GoogleAuth
+from app.script_runner import ScriptRunner
+
+class ConsoleHandler:
+    """Stands in for ApplicationUI when there is no window; logs go to stderr."""
+
+    def __init__(self, label):
+        self.label = label
+
+    def log_message(self, message, error=False):
+        level = "ERROR" if error else "INFO"
+        print(f"[{self.label}] {level}: {message}", file=sys.stderr)
+
+    def update_progress(self, value):
+        pass
+
+    def enable_buttons(self):
+        pass
+
+def load_manifest(manifest_path):
+    """Reads a batch manifest and resolves image paths relative to it.
+
+    The manifest is a JSON list of jobs, or an object with a "jobs" list. Each job has a
+    "site" label, a "week" number, an optional Drive "folder_id" (the project folder by
+    default) and "images" mapping Monday..Friday to JPEG paths.
+    """
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    jobs = manifest.get("jobs", []) if isinstance(manifest, dict) else manifest
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for job in jobs:
+        if "week" not in job or "images" not in job:
+            raise ValueError(f"Job {job.get('site', '?')} needs a 'week' and 'images'")
+        job["images"] = {day: os.path.join(base_dir, path) for day, path in job["images"].items()}
+    return jobs
+
+async def run_job(config, credentials, job, semaphore):
+    """Runs one manifest entry and returns its summary."""
+    label = f"{job.get('site', 'default')}/week {job['week']}"
+    async with semaphore:
+        runner = ScriptRunner(config, credentials=credentials)
+        start = time.perf_counter()
+        try:
+            await runner.run_script(job["images"], ConsoleHandler(label), week_number=int(job["week"]),
+                                    project_folder_id=job.get("folder_id"))
+        except Exception as e:
+            runner.status, runner.error = 'failed', f"Unexpected error: {e}"
+        return {
+            "site": job.get("site"),
+            "week": int(job["week"]),
+            "folder_id": runner.project_folder_id or job.get("folder_id"),
+            "status": runner.status,
+            "form_id": runner.form_id,
+            "error": runner.error,
+            "seconds": round(time.perf_counter() - start, 3),
+            "stages": runner.stage_timings,
+            "critical_path": runner.critical_path,
+            "peak_rss_mb": runner.peak_rss_mb,
+            "trace": runner.trace_path,
+        }
+
+async def run_batch(config, jobs, max_jobs):
+    """Runs the jobs concurrently over shared credentials, clients and quota."""
+    credentials = await GoogleAuth(config).get_credentials_async()
+    semaphore = asyncio.Semaphore(max_jobs)
+    return await asyncio.gather(*(run_job(config, credentials, job, semaphore) for job in jobs))
+
+async def run_watch(config, directory, week, interval, folder_id):
+    """Prepares the menus of the images dropped in directory until interrupted."""
+    from app.watcher import MenuPrefetcher
+    credentials = await GoogleAuth(config).get_credentials_async()
+    prefetcher = MenuPrefetcher(config, ConsoleHandler("watch"), credentials=credentials)
+    await prefetcher.watch(directory, week_number=week, interval=interval, project_folder_id=folder_id)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Weekly Meal Order Form Generator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    batch_parser = subparsers.add_parser("batch", help="build the forms listed in a manifest")
+    batch_parser.add_argument("manifest", help="JSON manifest of (site, week, day -> image) jobs")
+    batch_parser.add_argument("--max-jobs", type=int, default=4, help="jobs run at the same time (default: 4)")
+    watch_parser = subparsers.add_parser("watch", help="upload and extract menu images as they arrive in a folder")
+    watch_parser.add_argument("directory", nargs="?", help="folder to watch (default: WATCH_DIR)")
+    watch_parser.add_argument("--week", type=int, help="week of images without one in their name (default: current)")
+    watch_parser.add_argument("--interval", type=float, help="seconds between scans (default: WATCH_INTERVAL_SECONDS)")
+    watch_parser.add_argument("--folder-id", help="Drive project folder (default: GOOGLE_DRIVE_PROJECT_FOLDER_ID)")
+    args = parser.parse_args(argv)
+
+    try:
+        config = Config()
+        jobs = load_manifest(args.manifest) if args.command == "batch" else None
+    except (ConfigError, OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    if args.command == "watch":
+        directory = args.directory or config.WATCH_DIR
+        if not directory or not os.path.isdir(directory):
+            print(f"Error: not a folder to watch: {directory}", file=sys.stderr)
+            return 2
+        try:
+            asyncio.run(run_watch(config, directory, args.week, args.interval or config.WATCH_INTERVAL_SECONDS,
+                                  args.folder_id))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    start = time.perf_counter()
+    results = asyncio.run(run_batch(config, jobs, args.max_jobs))
+    summary = {"seconds": round(time.perf_counter() - start, 3), "jobs": results}
+    print(json.dumps(summary, indent=2))
+    # A partial form still needs a rerun, so it counts as a failure
+    return 0 if all(result["status"] in ("completed", "exists") for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
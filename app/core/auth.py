@@ -1,42 +1,209 @@
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from app.core.utils import logging
+from app.core.utils import logging, write_atomic
+from concurrent.futures import Future
+from datetime import datetime, timezone
+import asyncio
 import os
+import threading
+
+# Refresh this many seconds before the access token expires
+REFRESH_MARGIN = 300
+# Never schedule background refreshes closer together than this
+MIN_REFRESH_INTERVAL = 60
+
+class CredentialManagerError(Exception):
+    """Custom exception for CredentialManager errors."""
+    pass
+
+class CredentialManager:
+    """Keeps one set of Google credentials in memory and refreshes it ahead of expiry.
+
+    Every client shares the same Credentials object, refreshed in place on a background
+    timer, so a run never waits for a token on the event loop. Concurrent callers that
+    find the token missing or expired wait on a single refresh. The HTTP transports hold
+    `managed` instead, so their refreshes also go through here.
+    """
+
+    def __init__(self, config, token_path=None, refresh_margin=REFRESH_MARGIN):
+        self.config = config
+        # Use a known writable location for token.json (e.g., user's home directory)
+        self.token_path = token_path or os.path.join(os.path.expanduser("~"), "token.json")
+        self.refresh_margin = refresh_margin
+        self.credentials = None
+        self._inflight = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self.managed = ManagedCredentials(self)
+
+    def _seconds_left(self, creds):
+        if creds.expiry is None:
+            return None
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (creds.expiry - now).total_seconds()
+
+    def _expiring(self, creds):
+        seconds_left = self._seconds_left(creds)
+        return seconds_left is not None and seconds_left < self.refresh_margin
+
+    def get_credentials(self):
+        """Returns valid credentials, joining the refresh in flight if there is one."""
+        with self._lock:
+            creds = self.credentials
+            if creds is not None and creds.valid:
+                return creds
+        return self._refresh()
+
+    async def get_credentials_async(self):
+        """Returns valid credentials without blocking the event loop."""
+        with self._lock:
+            creds = self.credentials
+            if creds is not None and creds.valid:
+                return creds
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.get_credentials)
+
+    def refresh_rejected(self, token):
+        """Refreshes after an API rejected token, unless the token was replaced in the meantime."""
+        with self._lock:
+            creds = self.credentials
+            if creds is not None and creds.valid and creds.token != token:
+                return creds
+        return self._refresh()
+
+    def _refresh(self):
+        """Loads, refreshes or obtains credentials; one caller does the work, the others wait for it."""
+        with self._lock:
+            future = self._inflight
+            leader = future is None
+            if leader:
+                future = self._inflight = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            creds = self._obtain()
+        except Exception as e:
+            with self._lock:
+                self._inflight = None
+            future.set_exception(CredentialManagerError(f"Could not obtain Google credentials: {e}"))
+            return future.result()
+        with self._lock:
+            self.credentials = creds
+            self._inflight = None
+        future.set_result(creds)
+        self._schedule_refresh(creds)
+        return creds
+
+    def _obtain(self):
+        creds = self.credentials
+        if creds is None and os.path.exists(self.token_path):
+            creds = Credentials.from_authorized_user_file(self.token_path, self.config.GOOGLE_PROJECT_SCOPES)
+            if creds.valid and not self._expiring(creds):
+                return creds
+
+        if creds and creds.refresh_token:
+            logging.info("Refreshing Google API token...")
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(
+                self.config.GOOGLE_OAUTH2_FILE,
+                self.config.GOOGLE_PROJECT_SCOPES
+            )
+            creds = flow.run_local_server(port=0)
+        self._save_token(creds)
+        return creds
+
+    def _save_token(self, creds):
+        """Writes the token file atomically; a failed write only costs a refresh next start."""
+        try:
+            write_atomic(self.token_path, creds.to_json())
+        except OSError as e:
+            logging.warning(f"Could not save the Google API token to {self.token_path}: {e}")
+
+    def _schedule_refresh(self, creds):
+        seconds_left = self._seconds_left(creds)
+        if seconds_left is None or not creds.refresh_token:
+            return
+        delay = max(MIN_REFRESH_INTERVAL, seconds_left - self.refresh_margin)
+        timer = threading.Timer(delay, self._refresh_in_background)
+        timer.daemon = True
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = timer
+        timer.start()
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except CredentialManagerError as e:
+            logging.warning(f"Background token refresh failed, retrying on next use: {e}")
+
+class ManagedCredentials:
+    """Stands in for the shared Credentials in the HTTP transports and leaves every refresh to the manager.
+
+    google_auth_httplib2 refreshes the credentials it holds once the token expired and after
+    a 401. Done on the shared Credentials, that bypassed the single refresh and the token file.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        # The token each thread's transport sent last, to tell a rejected token from a replaced one
+        self._local = threading.local()
+
+    @property
+    def token(self):
+        return self.manager.get_credentials().token
+
+    @property
+    def valid(self):
+        return self.manager.get_credentials().valid
+
+    def apply(self, headers, token=None):
+        creds = self.manager.get_credentials()
+        self._local.token = creds.token
+        creds.apply(headers, token=token)
+
+    def before_request(self, request, method, url, headers):
+        self.apply(headers)
+
+    def refresh(self, request):
+        self.manager.refresh_rejected(getattr(self._local, 'token', None))
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_credential_manager(config):
+    """Returns the process-wide credential manager, so runs share one token."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = CredentialManager(config)
+        return _manager
 
 class GoogleAuth:
     def __init__(self, config):
         self.config = config
+        self.manager = get_credential_manager(config)
         self.credentials = None
 
     def authenticate(self):
-        """Authenticates the user using OAuth 2.0 and stores credentials."""
-        creds = None
-        # Use a known writable location for token.json (e.g., user's home directory)
-        token_path = os.path.join(os.path.expanduser("~"), "token.json")
-
-        if os.path.exists(token_path):
-            creds = Credentials.from_authorized_user_file(token_path, self.config.GOOGLE_PROJECT_SCOPES)
-
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                logging.info("Refreshing Google API token...")
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.config.GOOGLE_OAUTH2_FILE,
-                    self.config.GOOGLE_PROJECT_SCOPES
-                )
-                creds = flow.run_local_server(port=0)
-
-            with open(token_path, 'w') as token:
-                token.write(creds.to_json())
-
-        self.credentials = creds
-        return creds
+        """Authenticates the user using OAuth 2.0 and stores credentials refreshed by the manager."""
+        self.manager.get_credentials()
+        self.credentials = self.manager.managed
+        return self.credentials
 
     def get_credentials(self):
         """Returns the user's credentials."""
         if not self.credentials:
             self.credentials = self.authenticate()
-        return self.credentials
\ No newline at end of file
+        return self.credentials
+
+    async def get_credentials_async(self):
+        """Returns the user's credentials, doing any refresh off the event loop."""
+        if not self.credentials:
+            await self.manager.get_credentials_async()
+            self.credentials = self.manager.managed
+        return self.credentials
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import time
+from app.core.utils import logging, write_atomic
+
+class MenuCache:
+    """Content-addressed on-disk cache of the menu JSON extracted by Gemini."""
+
+    def __init__(self, cache_dir, model_name, prompt, max_bytes=50 * 1024 * 1024, max_age=30 * 86400,
+                 enabled=True):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.prompt_hash = hashlib.sha256((prompt or "").encode("utf-8")).hexdigest()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key_for(self, image_data):
+        """Returns the cache key for an image under the current model and prompt."""
+        image_hash = hashlib.sha256(image_data).hexdigest()
+        return hashlib.sha256(f"{image_hash}:{self.model_name}:{self.prompt_hash}".encode("utf-8")).hexdigest()
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, image_data):
+        """Returns the cached menu JSON string for an image, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self._path_for(self.key_for(image_data))
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as cache_file:
+                menu_json = cache_file.read()
+            # Touch the entry so size-based eviction drops the least recently used first
+            os.utime(path)
+            logging.info(f"Menu cache hit: {os.path.basename(path)}")
+            return menu_json
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f"Could not read menu cache entry {path}: {e}")
+            return None
+
+    def put(self, image_data, menu_json):
+        """Stores the menu JSON string for an image if it is valid JSON."""
+        if not self.enabled:
+            return
+        try:
+            json.loads(menu_json)
+        except (TypeError, ValueError):
+            logging.warning("Not caching menu: response is not valid JSON")
+            return
+        path = self._path_for(self.key_for(image_data))
+        try:
+            write_atomic(path, menu_json)
+        except OSError as e:
+            logging.warning(f"Could not write menu cache entry {path}: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes expired entries, then the least recently used ones above the size limit."""
+        now = time.time()
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    stat = entry.stat()
+                    if now - stat.st_mtime > self.max_age:
+                        os.remove(entry.path)
+                    else:
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            logging.warning(f"Could not scan menu cache: {e}")
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                logging.warning(f"Could not evict menu cache entry {path}: {e}")
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError as e:
+                    logging.warning(f"Could not remove menu cache entry {name}: {e}")
+        logging.info("Menu cache cleared")
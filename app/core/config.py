@@ -27,6 +27,45 @@ class Config:
         self.GOOGLE_OAUTH2_FILE = self._get_env("GOOGLE_OAUTH2_FILE")
         self.GOOGLE_PROJECT_SCOPES = json.loads(self._get_env('GOOGLE_PROJECT_SCOPES'))
         self.YOUR_EMAIL = self._get_env("YOUR_EMAIL")
+        self.MAX_CONCURRENT_DAYS = int(self._get_env("MAX_CONCURRENT_DAYS", "5"))
+        self.FILE_READY_TIMEOUT = float(self._get_env("FILE_READY_TIMEOUT", "30"))
+        self.DRIVE_REQUESTS_PER_MINUTE = float(self._get_env("DRIVE_REQUESTS_PER_MINUTE", "600"))
+        self.FORMS_REQUESTS_PER_MINUTE = float(self._get_env("FORMS_REQUESTS_PER_MINUTE", "300"))
+        self.GEMINI_REQUESTS_PER_MINUTE = float(self._get_env("GEMINI_REQUESTS_PER_MINUTE", "10"))
+        self.API_MAX_RETRIES = int(self._get_env("API_MAX_RETRIES", "5"))
+        self.API_CALL_DEADLINE = float(self._get_env("API_CALL_DEADLINE", "120"))
+        self.UPLOAD_CHUNK_SIZE_KB = int(self._get_env("UPLOAD_CHUNK_SIZE_KB", "1024"))
+        self.UPLOAD_DEDUP_ENABLED = self._get_bool_env("UPLOAD_DEDUP_ENABLED", True)
+        self.UPLOAD_SESSIONS_PATH = os.path.expanduser(
+            self._get_env("UPLOAD_SESSIONS_PATH", os.path.join("~", ".flolunchmenu", "upload_sessions.json")))
+        self.IMAGE_PREPROCESS_ENABLED = self._get_bool_env("IMAGE_PREPROCESS_ENABLED", True)
+        self.IMAGE_MAX_DIMENSION = int(self._get_env("IMAGE_MAX_DIMENSION", "2048"))
+        self.IMAGE_JPEG_QUALITY = int(self._get_env("IMAGE_JPEG_QUALITY", "85"))
+        self.RUN_JOURNAL_DIR = os.path.expanduser(
+            self._get_env("RUN_JOURNAL_DIR", os.path.join("~", ".flolunchmenu", "journal")))
+        self.RUN_JOURNAL_MIRROR = self._get_bool_env("RUN_JOURNAL_MIRROR", False)
+        self.DRIVE_BATCH_WINDOW_MS = float(self._get_env("DRIVE_BATCH_WINDOW_MS", "20"))
+        self.ASYNC_HTTP_ENABLED = self._get_bool_env("ASYNC_HTTP_ENABLED", False)
+        self.ASYNC_HTTP_MAX_CONNECTIONS = int(self._get_env("ASYNC_HTTP_MAX_CONNECTIONS", "20"))
+        self.DRIVE_INDEX_ENABLED = self._get_bool_env("DRIVE_INDEX_ENABLED", True)
+        self.DRIVE_INDEX_DIR = os.path.expanduser(
+            self._get_env("DRIVE_INDEX_DIR", os.path.join("~", ".flolunchmenu", "drive_index")))
+        self.GEMINI_BATCH_EXTRACTION = self._get_bool_env("GEMINI_BATCH_EXTRACTION", True)
+        self.GEMINI_STREAMING = self._get_bool_env("GEMINI_STREAMING", False)
+        self.MENU_CACHE_ENABLED = self._get_bool_env("MENU_CACHE_ENABLED", True)
+        self.MENU_CACHE_CLEAR = self._get_bool_env("MENU_CACHE_CLEAR", False)
+        self.MENU_CACHE_DIR = os.path.expanduser(
+            self._get_env("MENU_CACHE_DIR", os.path.join("~", ".flolunchmenu", "menu_cache")))
+        self.MENU_CACHE_MAX_MB = float(self._get_env("MENU_CACHE_MAX_MB", "50"))
+        self.MENU_CACHE_MAX_AGE_DAYS = float(self._get_env("MENU_CACHE_MAX_AGE_DAYS", "30"))
+        self.FORM_TEMPLATE_ID = self._get_env("FORM_TEMPLATE_ID", "") or None
+        self.WATCH_DIR = os.path.expanduser(self._get_env("WATCH_DIR", "")) or None
+        self.WATCH_INTERVAL_SECONDS = float(self._get_env("WATCH_INTERVAL_SECONDS", "5"))
+        self.TRACING_ENABLED = self._get_bool_env("TRACING_ENABLED", True)
+        self.TRACE_DIR = os.path.expanduser(
+            self._get_env("TRACE_DIR", os.path.join("~", ".flolunchmenu", "traces")))
+        self.TRACE_MAX_RUNS = int(self._get_env("TRACE_MAX_RUNS", "50"))
+        self.TRACE_MAX_AGE_DAYS = float(self._get_env("TRACE_MAX_AGE_DAYS", "30"))
         self.GEMINI_PROMPT = None
 
         # Load the prompt from a separate file
@@ -42,6 +81,12 @@ class Config:
             self.GEMINI_PROMPT = None
             raise ConfigError("Error: prompt.txt file not found.")
 
+    def _get_bool_env(self, key, default):
+        value = os.getenv(key)
+        if value is None or value.strip() == "":
+            return default
+        return value.strip().lower() in ("1", "true", "yes", "on")
+
     def _get_env(self, key, default=None):
         value = os.getenv(key, default)
         if value is None:
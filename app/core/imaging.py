@@ -0,0 +1,54 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from app.core.utils import logging
+
+EXIF_ORIENTATION = 0x0112
+
+def preprocess_image(source_path, target_path, max_dimension, quality):
+    """Applies EXIF orientation, downscales and re-encodes a JPEG without metadata.
+
+    Returns (path, original_bytes, processed_bytes). The original file is kept whenever
+    the processed one would not be smaller; it still carries its own orientation tag.
+    """
+    from PIL import Image, ImageOps
+
+    original_bytes = os.path.getsize(source_path)
+    with Image.open(source_path) as original:
+        # exif_transpose always returns a copy, so only call it when the tag asks for a rotation
+        orientation = original.getexif().get(EXIF_ORIENTATION, 1)
+        image = ImageOps.exif_transpose(original) if orientation != 1 else original
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        # No exif/icc_profile arguments: the metadata is left out of the new file
+        image.save(target_path, 'JPEG', quality=quality, optimize=True)
+
+    processed_bytes = os.path.getsize(target_path)
+    if processed_bytes >= original_bytes:
+        os.remove(target_path)
+        return str(source_path), original_bytes, original_bytes
+    return target_path, original_bytes, processed_bytes
+
+def preprocess_images(image_paths, output_dir, max_dimension=2048, quality=85, max_workers=None):
+    """Preprocesses a dict of day -> JPEG path in a process pool.
+
+    Returns a dict of day -> (path, original_bytes, processed_bytes). Days that fail keep
+    their original file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers or min(len(image_paths), os.cpu_count() or 1)) as pool:
+        futures = {
+            day: pool.submit(preprocess_image, str(path), os.path.join(output_dir, f"{day}.jpeg"),
+                             max_dimension, quality)
+            for day, path in image_paths.items()
+        }
+        for day, future in futures.items():
+            try:
+                results[day] = future.result()
+            except Exception as e:
+                logging.warning(f"Could not preprocess image for {day}, using the original: {e}")
+                size = os.path.getsize(image_paths[day])
+                results[day] = (str(image_paths[day]), size, size)
+    return results
@@ -0,0 +1,102 @@
+import json
+import os
+import time
+from app.core.utils import logging, write_atomic
+
+class RunJournal:
+    """Per-week record of the completed stages of a run, so a rerun resumes instead of restarting.
+
+    Uploaded images and extracted menus are stored with the MD5 of the image they came
+    from, so choosing another image for a day makes its entries stale.
+    """
+
+    def __init__(self, journal_dir, project_folder_id, week_number):
+        self.path = os.path.join(journal_dir, f"{project_folder_id}_week_{week_number}.json")
+        self.state = self._initial_state(project_folder_id, week_number)
+        self._load()
+
+    @staticmethod
+    def _initial_state(project_folder_id, week_number):
+        return {
+            'project_folder_id': project_folder_id,
+            'week_number': week_number,
+            'week_folder_id': None,
+            'form_id': None,
+            'from_template': False,
+            'form_moved': False,
+            'permissions_set': False,
+            'images': {},
+            'menus': {},
+            'form_configured': False,
+            'missing_days': [],
+        }
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as journal_file:
+                self.state.update(json.load(journal_file))
+            logging.info(f"Loaded run journal {self.path}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable run journal {self.path}: {e}")
+
+    def to_json(self):
+        return json.dumps(self.state, indent=2)
+
+    def save(self):
+        """Writes the journal atomically."""
+        self.state['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        try:
+            write_atomic(self.path, self.to_json())
+        except OSError as e:
+            logging.warning(f"Could not save run journal {self.path}: {e}")
+
+    def get(self, key):
+        return self.state.get(key)
+
+    def update(self, **fields):
+        """Records stage results and saves."""
+        self.state.update(fields)
+        self.save()
+
+    def reset(self):
+        """Forgets the Drive stages, e.g. when the week folder they happened in is gone, and saves.
+
+        Extracted menus are kept; they only depend on the image content.
+        """
+        menus = self.state['menus']
+        self.state = self._initial_state(self.state['project_folder_id'], self.state['week_number'])
+        self.state['menus'] = menus
+        self.save()
+
+    def discard(self):
+        """Removes the journal once the week is done; nothing is left to resume."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove run journal {self.path}: {e}")
+
+    def image(self, day, digest):
+        """Returns the uploaded image ID of a day if it was recorded for the image with this digest."""
+        entry = self.state['images'].get(day)
+        if isinstance(entry, dict) and entry.get('digest') == digest:
+            return entry.get('id')
+        return None
+
+    def menu(self, day, digest):
+        """Returns the menu of a day if it was extracted from the image with this digest."""
+        entry = self.state['menus'].get(day)
+        if isinstance(entry, dict) and entry.get('digest') == digest:
+            return entry.get('menu')
+        return None
+
+    def set_image(self, day, image_id, digest):
+        self.state['images'][day] = {'id': image_id, 'digest': digest}
+        self.save()
+
+    def set_menu(self, day, menu, digest):
+        self.state['menus'][day] = {'menu': menu, 'digest': digest}
+        self.save()
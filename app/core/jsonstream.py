@@ -0,0 +1,42 @@
+import json
+
+class JsonArrayStreamParser:
+    """Incrementally parses a top-level JSON array, returning each element as soon as it is complete."""
+
+    def __init__(self):
+        self.buffer = ''
+        self.started = False
+        self.done = False
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        """Adds streamed text and returns the elements completed by it."""
+        self.buffer += text
+        items = []
+        pos = 0
+        while not self.done:
+            if not self.started:
+                start = self.buffer.find('[', pos)
+                if start == -1:
+                    pos = len(self.buffer)
+                    break
+                self.started = True
+                pos = start + 1
+            while pos < len(self.buffer) and self.buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(self.buffer):
+                break
+            if self.buffer[pos] == ']':
+                self.done = True
+                pos += 1
+                break
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                break  # Element not complete yet
+            if end == len(self.buffer) and not isinstance(item, (dict, list)):
+                break  # A number or literal may continue in the next chunk
+            items.append(item)
+            pos = end
+        self.buffer = self.buffer[pos:]
+        return items
@@ -0,0 +1,216 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from app.core.tracing import span
+from app.core.utils import logging
+
+# Statuses worth retrying: quota exhaustion and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class SchedulerError(Exception):
+    """Custom exception for RetryScheduler errors."""
+    pass
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at a fixed rate per minute."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, float(rate_per_minute))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, cost=1):
+        """Takes cost tokens if they are available; otherwise returns how long to wait for them."""
+        cost = min(cost, self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.blocked_until and self.tokens >= cost:
+                self.tokens -= cost
+                return 0
+            return max(self.blocked_until - now, (cost - self.tokens) / self.rate if self.tokens < cost else 0)
+
+    def acquire(self, deadline=None, cost=1):
+        """Takes cost tokens, sleeping until they are available or the deadline would be missed.
+
+        A cost above the capacity takes the whole bucket, so it can't wait forever.
+        """
+        while True:
+            wait = self._take(cost)
+            if not wait:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise SchedulerError("Deadline exceeded while waiting for quota")
+            time.sleep(wait)
+
+    async def acquire_async(self, deadline=None, cost=1):
+        """Like acquire, but waits without blocking the event loop."""
+        while True:
+            wait = self._take(cost)
+            if not wait:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise SchedulerError("Deadline exceeded while waiting for quota")
+            await asyncio.sleep(wait)
+
+    def block(self, seconds):
+        """Holds every caller back, e.g. after the server asked to slow down."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+def error_status(error):
+    """Returns the HTTP status of a googleapiclient or google.api_core error, if any."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is None:
+        status = getattr(error, 'code', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def retry_after(error):
+    """Returns the delay in seconds requested by a Retry-After header, if any."""
+    resp = getattr(error, 'resp', None)
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+def is_transient(error):
+    """Tells whether an error is worth retrying."""
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+class RetryScheduler:
+    """Runs API calls under per-API token buckets with jittered exponential backoff.
+
+    Non-idempotent calls (creates) are only retried when the failure proves the request was
+    not applied (429), or when a probe confirms that nothing was created; if the probe finds
+    the resource, its result is returned instead of creating a duplicate.
+    """
+
+    def __init__(self, rates_per_minute, max_retries=5, base_delay=1.0, max_delay=60.0, deadline=120.0):
+        self.buckets = {api: TokenBucket(rate) for api, rate in rates_per_minute.items()}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def call(self, api, fn, *args, idempotent=True, probe=None, deadline=None, cost=1, **kwargs):
+        """Calls fn under the quota of api, retrying transient failures until the deadline.
+
+        cost is the number of API calls fn makes, e.g. the size of a batch request.
+        """
+        owner = getattr(fn, '__self__', None)
+        method = getattr(owner, 'methodId', None) or getattr(fn, '__name__', 'call')
+        with span(f"{api}:{method}", 'request', api=api, method=method, retries=0, quota_wait=0.0) as request_span:
+            return self._call(api, fn, args, kwargs, idempotent, probe, deadline, cost, request_span)
+
+    def _call(self, api, fn, args, kwargs, idempotent, probe, deadline, cost, request_span):
+        bucket = self.buckets.get(api)
+        end = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                waited = time.monotonic()
+                bucket.acquire(end, cost)
+                if request_span is not None:
+                    request_span.add(quota_wait=time.monotonic() - waited)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e):
+                    raise
+                if not idempotent and error_status(e) != 429:
+                    if probe is None:
+                        raise
+                    existing = probe()
+                    if existing is not None:
+                        logging.info(f"{api}: request was applied despite the error, reusing the result")
+                        return existing
+                attempt += 1
+                time.sleep(self._backoff(api, e, attempt, end, bucket, request_span))
+
+    async def call_async(self, api, fn, *args, idempotent=True, probe=None, deadline=None, method_id=None,
+                         cost=1, **kwargs):
+        """Awaits fn(*args, **kwargs) under the same quotas and retry policy as call; probe is a coroutine too."""
+        method = method_id or getattr(fn, '__name__', 'call')
+        with span(f"{api}:{method}", 'request', api=api, method=method, retries=0, quota_wait=0.0) as request_span:
+            bucket = self.buckets.get(api)
+            end = time.monotonic() + (deadline or self.deadline)
+            attempt = 0
+            while True:
+                if bucket is not None:
+                    waited = time.monotonic()
+                    await bucket.acquire_async(end, cost)
+                    if request_span is not None:
+                        request_span.add(quota_wait=time.monotonic() - waited)
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_transient(e):
+                        raise
+                    if not idempotent and error_status(e) != 429:
+                        if probe is None:
+                            raise
+                        existing = await probe()
+                        if existing is not None:
+                            logging.info(f"{api}: request was applied despite the error, reusing the result")
+                            return existing
+                    attempt += 1
+                    await asyncio.sleep(self._backoff(api, e, attempt, end, bucket, request_span))
+
+    def _backoff(self, api, error, attempt, end, bucket, request_span):
+        """Returns the delay before retry number attempt, re-raising error when the deadline would pass."""
+        status = error_status(error)
+        requested = retry_after(error)
+        delay = requested if requested is not None else random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if time.monotonic() + delay > end:
+            raise error
+        if status == 429 and bucket is not None:
+            bucket.block(delay)
+        if request_span is not None:
+            request_span.set(retries=attempt, last_status=status or type(error).__name__)
+        logging.warning(f"{api}: {status or type(error).__name__}, retry {attempt}/{self.max_retries} "
+                        f"in {delay:.1f}s")
+        return delay
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(config):
+    """Returns the process-wide scheduler, so every run shares the same quota."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RetryScheduler(
+                {
+                    'drive': config.DRIVE_REQUESTS_PER_MINUTE,
+                    'forms': config.FORMS_REQUESTS_PER_MINUTE,
+                    'gemini': config.GEMINI_REQUESTS_PER_MINUTE,
+                },
+                max_retries=config.API_MAX_RETRIES,
+                deadline=config.API_CALL_DEADLINE,
+            )
+        return _scheduler
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+class TaskGraphError(Exception):
+    """Custom exception for TaskGraph errors."""
+    pass
+
+class StopGraph(Exception):
+    """Raised by a node to end the run early without an error; nodes still pending are cancelled."""
+    pass
+
+class TaskGraph:
+    """Runs async nodes as soon as the nodes they depend on have finished.
+
+    Each node is a coroutine function called without arguments; its result is kept in
+    results. The first failure cancels every node still running and is re-raised.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.results = {}
+        self.timings = {}
+        self.stopped = False
+
+    def add(self, name, fn, depends_on=()):
+        if name in self.nodes:
+            raise TaskGraphError(f"Duplicate node: {name}")
+        self.nodes[name] = (fn, tuple(depends_on))
+
+    def _check(self):
+        """Rejects unknown dependencies and cycles."""
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise TaskGraphError(f"Dependency cycle: {' -> '.join(path + [name])}")
+            state[name] = 'visiting'
+            for dependency in self.nodes[name][1]:
+                if dependency not in self.nodes:
+                    raise TaskGraphError(f"{name} depends on unknown node {dependency}")
+                visit(dependency, path + [name])
+            state[name] = 'done'
+
+        for name in self.nodes:
+            visit(name, [])
+
+    async def run(self):
+        """Runs every node and returns the results; returns early when a node raises StopGraph."""
+        self._check()
+        origin = time.perf_counter()
+        tasks = {}
+
+        async def run_node(name):
+            fn, depends_on = self.nodes[name]
+            if depends_on:
+                await asyncio.gather(*(tasks[dependency] for dependency in depends_on))
+            start = time.perf_counter() - origin
+            try:
+                self.results[name] = await fn()
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                self.timings[name] = (start, time.perf_counter() - origin)
+                raise
+            self.timings[name] = (start, time.perf_counter() - origin)
+            return self.results[name]
+
+        for name in self.nodes:
+            tasks[name] = asyncio.ensure_future(run_node(name))
+        try:
+            await asyncio.gather(*tasks.values())
+        except StopGraph:
+            self.stopped = True
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return self.results
+
+    def critical_path(self):
+        """Returns [(node, seconds)] of the chain of finished nodes that determined the run time."""
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda node: self.timings[node][1])
+        path = []
+        while name is not None:
+            start, end = self.timings[name]
+            path.append((name, round(end - start, 3)))
+            finished = [dependency for dependency in self.nodes[name][1] if dependency in self.timings]
+            name = max(finished, key=lambda node: self.timings[node][1]) if finished else None
+        return list(reversed(path))
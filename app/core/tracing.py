@@ -0,0 +1,232 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from app.core.utils import logging, write_atomic
+
+_current_tracer = contextvars.ContextVar('current_tracer', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """One timed operation of a run: a stage, a helper call or a single API request."""
+
+    def __init__(self, span_id, parent_id, name, kind, attributes):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, **counts):
+        """Adds to numeric attributes, e.g. bytes sent by successive requests."""
+        for key, value in counts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + (value or 0)
+
+    def to_dict(self):
+        return {
+            'id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6) if self.duration is not None else None,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+class Tracer:
+    """Collects the spans of one run and exports them as a JSON trace and Prometheus metrics."""
+
+    def __init__(self, **attributes):
+        self.attributes = attributes
+        self.spans = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, kind='internal', **attributes):
+        """Times the enclosed block as a child of the current span."""
+        parent = _current_span.get()
+        with self.lock:
+            span = Span(next(self.ids), parent.span_id if parent else None, name, kind, attributes)
+            self.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.started
+            _current_span.reset(token)
+
+    def to_json(self):
+        with self.lock:
+            spans = [span.to_dict() for span in self.spans]
+        return json.dumps({'attributes': self.attributes, 'spans': spans}, indent=2)
+
+    def metrics(self):
+        """Aggregates the spans into {(metric, labels): value}."""
+        values = defaultdict(float)
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            if span.duration is None:
+                continue
+            attributes = span.attributes
+            if span.kind == 'run':
+                values[('run_duration_seconds', ())] += span.duration
+                peak = attributes.get('peak_rss_bytes')
+                if peak:
+                    values[('peak_rss_bytes', (('scope', attributes.get('peak_rss_scope')),))] = peak
+            elif span.kind == 'stage':
+                values[('stage_duration_seconds', (('stage', span.name),))] += span.duration
+            elif span.kind == 'request':
+                api = (('api', attributes.get('api')), ('method', attributes.get('method')))
+                values[('api_requests_total', api + (('outcome', 'error' if span.error else 'ok'),))] += 1
+                values[('api_request_duration_seconds_sum', api)] += span.duration
+                values[('api_request_duration_seconds_count', api)] += 1
+                values[('api_retries_total', api)] += attributes.get('retries', 0)
+                values[('api_quota_wait_seconds_total', api)] += attributes.get('quota_wait', 0)
+            elif span.kind == 'helper':
+                api = (('api', attributes.get('api')),)
+                operation = api + (('operation', span.name),)
+                values[('helper_duration_seconds_sum', operation)] += span.duration
+                values[('helper_duration_seconds_count', operation)] += 1
+                values[('api_bytes_sent_total', api)] += attributes.get('bytes_sent', 0)
+                values[('api_bytes_received_total', api)] += attributes.get('bytes_received', 0)
+                for token_type in ('prompt', 'output'):
+                    count = attributes.get(f'{token_type}_tokens')
+                    if count:
+                        values[('gemini_tokens_total', (('type', token_type),))] += count
+        return values
+
+    def to_prometheus(self, prefix='flolunchmenu'):
+        """Renders the metrics in the Prometheus text exposition format."""
+        run_labels = tuple((key, value) for key, value in self.attributes.items() if value is not None)
+        types = {}
+        lines = []
+        for (name, labels), value in sorted(self.metrics().items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            family = name[:-len('_sum')] if name.endswith('_sum') else name[:-len('_count')] if name.endswith(
+                '_count') else name
+            if family not in types:
+                types[family] = 'summary' if family != name else 'counter' if name.endswith('_total') else 'gauge'
+                lines.append(f"# TYPE {prefix}_{family} {types[family]}")
+            label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in run_labels + labels)
+            lines.append(f"{prefix}_{name}{{{label_text}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory, stem):
+        """Writes <stem>.trace.json and <stem>.prom into directory and returns the trace path."""
+        os.makedirs(directory, exist_ok=True)
+        trace_path = os.path.join(directory, f"{stem}.trace.json")
+        write_atomic(trace_path, self.to_json())
+        write_atomic(os.path.join(directory, f"{stem}.prom"), self.to_prometheus())
+        return trace_path
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def activate(tracer):
+    """Makes tracer the one used by the current context and the tasks and threads started from it."""
+    return _current_tracer.set(tracer)
+
+def deactivate(token):
+    _current_tracer.reset(token)
+
+@contextmanager
+def span(name, kind='internal', **attributes):
+    """Times the enclosed block under the active tracer; does nothing when there is none."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    with tracer.span(name, kind, **attributes) as current:
+        yield current
+
+def add_to_span(**counts):
+    """Adds counts, such as bytes or tokens, to the innermost active span."""
+    current = _current_span.get()
+    if current is not None:
+        current.add(**counts)
+
+def payload_size(payload):
+    """Approximates the wire size of a request body or response."""
+    if payload is None:
+        return 0
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload.encode('utf-8'))
+    try:
+        return len(json.dumps(payload))
+    except (TypeError, ValueError):
+        return 0
+
+def traced(api):
+    """Decorates a helper method so each call is recorded as a span of that API."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(f"{api}.{fn.__name__}", 'helper', api=api):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced_async(api):
+    """Like traced, for coroutine methods."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(f"{api}.{fn.__name__}", 'helper', api=api):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+TRACE_SUFFIXES = ('.trace.json', '.prom')
+
+def write_run_trace(tracer, directory, stem, max_runs=None, max_age=None):
+    """Writes the trace files of a run, then prunes old runs; logs instead of failing the run."""
+    try:
+        trace_path = tracer.write(directory, stem)
+    except OSError as e:
+        logging.warning(f"Could not write the run trace to {directory}: {e}")
+        return None
+    prune_traces(directory, max_runs, max_age)
+    return trace_path
+
+def prune_traces(directory, max_runs=None, max_age=None):
+    """Removes the trace files of runs older than max_age seconds, then all but the newest max_runs runs."""
+    now = time.time()
+    runs = defaultdict(list)
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                suffix = next((suffix for suffix in TRACE_SUFFIXES if entry.name.endswith(suffix)), None)
+                if suffix is not None:
+                    runs[entry.name[:-len(suffix)]].append((entry.stat().st_mtime, entry.path))
+    except OSError as e:
+        logging.warning(f"Could not scan the trace folder {directory}: {e}")
+        return
+    newest_first = sorted(runs.values(), key=lambda files: max(mtime for mtime, _ in files), reverse=True)
+    for position, files in enumerate(newest_first):
+        expired = max_age is not None and now - max(mtime for mtime, _ in files) > max_age
+        if not expired and (max_runs is None or position < max_runs):
+            continue
+        for _, path in files:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.warning(f"Could not remove old trace file {path}: {e}")
@@ -1,7 +1,19 @@
 import logging
+import hashlib
 import imghdr
+import mmap
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 def configure_logging(level=logging.INFO, log_file=None):
     """Configures the logging system."""
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -26,3 +38,122 @@ def handle_error(message, error=None):
 def is_valid_jpeg(file_path):
     """Checks if a file is a valid JPEG image using pathlib."""
     return imghdr.what(Path(file_path)) == 'jpeg'
+
+def write_atomic(path, text):
+    """Writes text to path through a temporary file and a rename, so readers never see half a file."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def file_digest(file_path, algorithm='md5', chunk_size=1024 * 1024):
+    """Returns the hex digest of a file, hashed window by window from a memory map."""
+    digest = hashlib.new(algorithm)
+    for window in file_chunks(file_path, chunk_size):
+        digest.update(window)
+    return digest.hexdigest()
+
+@contextmanager
+def mapped_file(file_path):
+    """Maps a file read-only; yields b'' for an empty file, which can't be mapped."""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+def release_pages(mapped, offset, length):
+    """Drops the pages of a read-only mapping from memory; they are read again if touched."""
+    if not hasattr(mapped, 'madvise') or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    start = offset - offset % mmap.PAGESIZE
+    end = min(offset + length, len(mapped))
+    if end > start:
+        mapped.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+def file_chunks(file_path, chunk_size=1024 * 1024, start=0):
+    """Yields views of a file in fixed-size windows of a memory map, without copying.
+
+    The pages of a window are released when the next one is requested, so about one
+    window stays resident whatever the file size. A view is only valid until then.
+    """
+    with mapped_file(file_path) as mapped:
+        for offset in range(start, len(mapped), chunk_size):
+            length = min(chunk_size, len(mapped) - offset)
+            with memoryview(mapped)[offset:offset + length] as window:
+                yield window
+            release_pages(mapped, offset, length)
+
+def current_rss_bytes():
+    """Returns the resident memory of this process right now, in bytes, or None where it can't be read.
+
+    Reads /proc/self/statm on Linux and falls back to psutil when it is installed.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+def peak_rss_bytes():
+    """Returns the highest resident memory of this process since it started, in bytes.
+
+    None where the resource module is missing (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+class MemorySampler:
+    """Samples the resident memory of the process in a thread and keeps the highest value.
+
+    Unlike ru_maxrss, the peak only covers the time between start() and stop(). peak
+    stays None where the current resident memory can't be read.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        if self.peak is not None:
+            self.thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops sampling and returns the peak in bytes."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self._sample()
+        return self.peak
@@ -1,150 +1,596 @@
 # --- Core Logic Layer: script_runner.py ---
 import asyncio
+import contextvars
+import functools
 import json
+import os
+import shutil
+import tempfile
+import time
 from datetime import datetime
-from app.core.utils import configure_logging, is_valid_jpeg
+from app.core.utils import MemorySampler, configure_logging, file_digest, is_valid_jpeg, peak_rss_bytes
 from app.core.auth import GoogleAuth
+from app.core.cache import MenuCache
+from app.core.imaging import preprocess_images
+from app.core.journal import RunJournal
+from app.core.scheduler import error_status, get_scheduler
+from app.core.taskgraph import StopGraph, TaskGraph
+from app.core.tracing import Tracer, activate, deactivate, span, write_run_trace
+from app.services.async_google import (AsyncGoogleClient, AsyncGoogleDriveHelper, AsyncGoogleFormsHelper,
+                                       async_http_available)
+from app.services.clients import get_client_factory
 from app.services.gdrive import GoogleDriveHelper, GoogleDriveHelperError
+from app.services.upload_sessions import UploadSessionStore
 from app.services.gforms import GoogleFormsHelper, GoogleFormsHelperError
-from app.services.gemini import GoogleGeminiHelper, GoogleGeminiHelperError
+from app.services.gemini import GoogleGeminiHelper, GoogleGeminiHelperError, is_valid_menu
 
 configure_logging()
 
+# Items added per day: the menu image, the soup question and the main course question
+ITEMS_PER_DAY = 3
+
 class ScriptRunnerError(Exception):
     """Custom exception for ScriptRunner errors."""
     pass
 
 class ScriptRunner:
-    def __init__(self, config):
+    def __init__(self, config, credentials=None, client_factory=None):
         self.config = config
+        self.credentials = credentials
+        self.client_factory = client_factory
         self.ui_handler = None
         self.days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
-        self.data = {day: {'menu': [], 'image_id': None} for day in self.days}
+        self.data = {day: {'menu': None, 'image_id': None} for day in self.days}
+        self.status = None
+        self.error = None
+        self.form_id = None
+        self.week_number = None
+        self.project_folder_id = None
+        self.stage_timings = {}
+        self.critical_path = []
+        self.tracer = None
+        self.trace_path = None
+        self.peak_rss_mb = None
+        self.async_client = None
+        self.drive_async = None
+        self.forms_async = None
+        self.image_digests = {}
 
-    async def run_script(self, selected_image_paths, ui_handler):
+    async def run_script(self, selected_image_paths, ui_handler, week_number=None, project_folder_id=None):
+        """Builds the form of a week; defaults to the current week and the configured project folder."""
         self.ui_handler = ui_handler
+        self.preprocess_dir = None
+        self.data = {day: {'menu': None, 'image_id': None} for day in self.days}
+        self.status, self.error, self.form_id = 'running', None, None
+        self.stage_timings = {}
+        self.week_number = week_number or datetime.now().isocalendar()[1]
+        self.project_folder_id = project_folder_id or self.config.GOOGLE_DRIVE_PROJECT_FOLDER_ID
+        self.journal = RunJournal(self.config.RUN_JOURNAL_DIR, self.project_folder_id, self.week_number)
+        self.resuming = False
+        self.progress = 0
+        self.completed_days = 0
+        self.upload_progress = {}
+        self.image_digests = {}
+        self.missing_days = []
+        self.critical_path = []
+        self.checkpoint_lock = asyncio.Lock()
+        self.tracer = Tracer(folder=self.project_folder_id, week=self.week_number)
+        self.trace_path = None
+        tracer_token = activate(self.tracer)
+        memory = MemorySampler().start()
+        try:
+            with span('run', 'run') as run_span:
+                try:
+                    await self.run_stages(selected_image_paths)
+                finally:
+                    self.record_peak_memory(run_span, memory.stop())
+                    run_span.set(status=self.status, error=self.error, critical_path=self.critical_path)
+        finally:
+            deactivate(tracer_token)
+            if self.config.TRACING_ENABLED:
+                self.trace_path = write_run_trace(
+                    self.tracer, self.config.TRACE_DIR,
+                    f"{self.project_folder_id}_week_{self.week_number}_{datetime.now():%Y%m%d-%H%M%S}",
+                    max_runs=self.config.TRACE_MAX_RUNS, max_age=self.config.TRACE_MAX_AGE_DAYS * 86400)
+
+    def record_peak_memory(self, run_span, sampled_peak):
+        """Logs the peak resident memory and records it on the run span.
+
+        The peak sampled during the run is process-wide, so it includes concurrent runs but
+        not the image preprocessing workers. Where it can't be sampled, the process peak
+        since it started is reported instead, and labelled so.
+        """
+        if sampled_peak is not None:
+            peak, scope, label = sampled_peak, 'run', "Peak memory during the run"
+        else:
+            peak, scope, label = peak_rss_bytes(), 'process', "Peak memory of the process so far"
+        if peak is None:
+            return
+        self.peak_rss_mb = round(peak / 2 ** 20, 1)
+        self.ui_handler.log_message(f"{label}: {self.peak_rss_mb} MB")
+        if run_span is not None:
+            run_span.set(peak_rss_bytes=peak, peak_rss_scope=scope)
+
+    async def run_stages(self, selected_image_paths):
+        """Runs the stages of run_script as a dependency graph, so independent stages overlap."""
+        graph = TaskGraph()
+
+        def stage(name, fn, depends_on=()):
+            graph.add(name, lambda: self.timed(name, fn()), depends_on)
+
+        def images():
+            return graph.results['preprocess_images']
+
+        stage('validate_inputs', lambda: self.validate_inputs(selected_image_paths))
+        stage('preprocess_images', lambda: self.preprocess_images(selected_image_paths), ['validate_inputs'])
+        stage('initialize_helpers', self.initialize_helpers, ['validate_inputs'])
+        stage('process_week_folder', lambda: self.process_week_folder(self.week_number), ['initialize_helpers'])
+        # Only the lookup gates the rest: when the form exists, nothing is extracted or uploaded
+        stage('find_form', lambda: self.find_form(self.week_number), ['process_week_folder'])
+        stage('check_or_create_form', lambda: self.check_or_create_form(self.week_number), ['find_form'])
+        stage('move_form', lambda: self.move_form(self.week_number), ['check_or_create_form'])
+        stage('set_form_permissions', self.async_set_form_permissions, ['check_or_create_form'])
+        stage('extract_menus', lambda: self.extract_menus(images()), ['preprocess_images', 'find_form'])
+        stage('upload_images', lambda: self.upload_images(images()), ['preprocess_images', 'find_form'])
+        stage('configure_form', self.configure_form, ['check_or_create_form', 'extract_menus', 'upload_images'])
         try:
-            await self.validate_inputs(selected_image_paths)
-            await self.initialize_helpers()
-            week_number = datetime.now().isocalendar()[1]
-            await self.process_week_folder(week_number)
-            form_id = await self.check_or_create_form(week_number)
-            if not form_id:  # Form already exists, stop execution
+            await graph.run()
+            if graph.stopped:  # Form already exists, nothing else to do
+                self.status = 'exists'
                 return
-            await self.upload_and_process_images(selected_image_paths, form_id)
-            await self.configure_form(form_id)
-            self.ui_handler.update_progress(100)
+            if self.missing_days:
+                # Keep the journal, so the next run resumes this form and adds the missing days
+                self.journal.update(missing_days=self.missing_days)
+                await self.checkpoint()
+                self.status = 'partial'
+                self.error = f"Form built without {', '.join(self.missing_days)}"
+                self.ui_handler.log_message(f"{self.error}; run the week again to add them", error=True)
+                return
+            self.journal.update(form_configured=True, missing_days=[])
+            await self.checkpoint()
+            # A finished week has nothing to resume; a rerun finds the form in the week folder
+            self.journal.discard()
+            self.status = 'completed'
+            self.set_progress(100)
             self.ui_handler.log_message("Script finished")
         except ScriptRunnerError as e:
+            self.status, self.error = 'failed', str(e)
             self.ui_handler.log_message(str(e), error=True)
         finally:
+            self.critical_path = graph.critical_path()
+            if self.critical_path:
+                self.ui_handler.log_message("Critical path: " + " -> ".join(
+                    f"{name} {seconds:.1f}s" for name, seconds in self.critical_path))
+            if self.preprocess_dir:
+                shutil.rmtree(self.preprocess_dir, ignore_errors=True)
+            await self.close_async_http()
             self.ui_handler.enable_buttons()
 
+    def set_progress(self, value):
+        """Moves the progress bar forward only, since concurrent stages report out of order."""
+        if value > self.progress:
+            self.progress = value
+            self.ui_handler.update_progress(value)
+
+    async def checkpoint(self):
+        """Mirrors the run journal to the week folder when enabled; failures are only logged."""
+        if not self.config.RUN_JOURNAL_MIRROR or not self.journal.get('week_folder_id'):
+            return
+        try:
+            # Concurrent stages checkpoint too; one at a time so the mirror is created only once
+            async with self.checkpoint_lock:
+                await self.run_blocking(self.drive_helper.save_text_file, 'run_journal.json', self.journal.to_json(),
+                                        self.journal.get('week_folder_id'))
+        except GoogleDriveHelperError as e:
+            self.ui_handler.log_message(f"Could not mirror the run journal: {e}", error=True)
+
+    async def timed(self, stage, coroutine):
+        """Awaits a stage, records its wall time in stage_timings and traces it."""
+        start = time.perf_counter()
+        try:
+            with span(stage, 'stage'):
+                return await coroutine
+        finally:
+            self.stage_timings[stage] = round(time.perf_counter() - start, 3)
+
+    async def run_blocking(self, fn, *args):
+        """Runs a blocking helper call in the default executor so other runs keep going."""
+        loop = asyncio.get_event_loop()
+        # Carries the active tracer and span into the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, functools.partial(context.run, fn, *args))
+
+    async def drive_call(self, method, *args):
+        """Calls a Drive helper method on the event loop when async HTTP is enabled, else in the executor."""
+        if self.drive_async is not None:
+            return await getattr(self.drive_async, method)(*args)
+        return await self.run_blocking(getattr(self.drive_helper, method), *args)
+
+    async def forms_call(self, method, *args):
+        """Calls a Forms helper method on the event loop when async HTTP is enabled, else in the executor."""
+        if self.forms_async is not None:
+            return await getattr(self.forms_async, method)(*args)
+        return await self.run_blocking(getattr(self.forms_helper, method), *args)
+
     async def validate_inputs(self, selected_image_paths):
         if not all(selected_image_paths.values()):
             raise ScriptRunnerError("Error: Please select an image for each day.")
         for day, path in selected_image_paths.items():
             if not is_valid_jpeg(path):
                 raise ScriptRunnerError(f"Error: Invalid file type for {day}. Please select a .jpeg image.")
-        self.ui_handler.update_progress(0)
+
+    async def preprocess_images(self, selected_image_paths):
+        """Shrinks the selected images before upload and extraction; returns the paths to use."""
+        if not self.config.IMAGE_PREPROCESS_ENABLED:
+            return selected_image_paths
+        self.preprocess_dir = tempfile.mkdtemp(prefix="flolunchmenu-")
+        try:
+            results = await self.run_blocking(
+                preprocess_images, dict(selected_image_paths), self.preprocess_dir,
+                self.config.IMAGE_MAX_DIMENSION, self.config.IMAGE_JPEG_QUALITY
+            )
+        except Exception as e:
+            self.ui_handler.log_message(f"Image preprocessing skipped: {e}", error=True)
+            return selected_image_paths
+        original_total = sum(original for _, original, _ in results.values())
+        processed_total = sum(processed for _, _, processed in results.values())
+        self.ui_handler.log_message(
+            f"Images preprocessed: {original_total / 1024:.0f} KB -> {processed_total / 1024:.0f} KB "
+            f"({(original_total - processed_total) / 1024:.0f} KB saved)")
+        return {day: path for day, (path, _, _) in results.items()}
 
     async def initialize_helpers(self):
-        auth = GoogleAuth(self.config)
-        credentials = auth.get_credentials()
-        self.drive_helper = GoogleDriveHelper(credentials)
-        self.forms_helper = GoogleFormsHelper(credentials)
+        if self.credentials is None:
+            self.credentials = await GoogleAuth(self.config).get_credentials_async()
+        credentials = self.credentials
+        client_factory = self.client_factory or get_client_factory(credentials)
+        scheduler = get_scheduler(self.config)
+        self.drive_helper = GoogleDriveHelper(credentials, client_factory, scheduler,
+                                              upload_sessions=UploadSessionStore(self.config.UPLOAD_SESSIONS_PATH),
+                                              chunk_size=self.config.UPLOAD_CHUNK_SIZE_KB * 1024)
+        if self.config.DRIVE_BATCH_WINDOW_MS > 0:
+            self.drive_helper.enable_batching(self.config.DRIVE_BATCH_WINDOW_MS / 1000)
+        if self.config.DRIVE_INDEX_ENABLED:
+            await self.run_blocking(self.drive_helper.enable_index, self.project_folder_id,
+                                    os.path.join(self.config.DRIVE_INDEX_DIR, f"{self.project_folder_id}.json"))
+        self.forms_helper = GoogleFormsHelper(credentials, client_factory, scheduler)
+        if self.config.ASYNC_HTTP_ENABLED:
+            self.enable_async_http(scheduler, client_factory)
+        self.menu_cache = MenuCache(self.config.MENU_CACHE_DIR,
+                                    self.config.GEMINI_MODEL_NAME,
+                                    self.config.GEMINI_PROMPT,
+                                    max_bytes=int(self.config.MENU_CACHE_MAX_MB * 1024 * 1024),
+                                    max_age=self.config.MENU_CACHE_MAX_AGE_DAYS * 86400,
+                                    enabled=self.config.MENU_CACHE_ENABLED)
+        if self.config.MENU_CACHE_CLEAR:
+            self.menu_cache.clear()
         self.gemini_helper = GoogleGeminiHelper(self.config.GEMINI_API_KEY, 
                                                 self.config.GEMINI_MODEL_NAME, 
                                                 self.config.GEMINI_PROMPT,
-                                                self.drive_helper.drive_service
+                                                self.drive_helper.drive_service,
+                                                cache=self.menu_cache,
+                                                scheduler=scheduler
                                                 )
 
+    def enable_async_http(self, scheduler, client_factory):
+        """Sends Drive and Forms calls from the event loop over pooled connections instead of the executor."""
+        if not async_http_available():
+            self.ui_handler.log_message("ASYNC_HTTP_ENABLED needs the httpx package, using the default transport",
+                                        error=True)
+            return
+        self.async_client = AsyncGoogleClient(self.config, max_connections=self.config.ASYNC_HTTP_MAX_CONNECTIONS,
+                                              transport=client_factory.async_transport())
+        self.drive_async = AsyncGoogleDriveHelper(self.async_client, scheduler, self.drive_helper.upload_sessions,
+                                                  self.drive_helper.chunk_size, index=self.drive_helper.index)
+        self.forms_async = AsyncGoogleFormsHelper(self.async_client, scheduler)
+
+    async def close_async_http(self):
+        """Closes the pooled connections of the run, which belong to its event loop."""
+        if self.async_client is not None:
+            await self.async_client.aclose()
+        self.async_client = self.drive_async = self.forms_async = None
+
     async def process_week_folder(self, week_number):
         week_folder_name = str(week_number)
         try:
-            week_folder_id = self.drive_helper.get_folder_id(week_folder_name,
-                                                            self.config.GOOGLE_DRIVE_PROJECT_FOLDER_ID)
+            journal_folder_id = self.journal.get('week_folder_id')
+            if journal_folder_id and await self.drive_call('folder_exists', journal_folder_id):
+                self.week_folder_id = journal_folder_id
+                self.ui_handler.log_message(f"Resuming with week folder: {self.week_folder_id}")
+                self.set_progress(10)
+                return
+            if journal_folder_id:
+                # Whatever the earlier run put in that folder is gone with it
+                self.ui_handler.log_message(f"Week folder {journal_folder_id} of the earlier run is gone, "
+                                            f"starting over")
+                self.journal.reset()
+            week_folder_id = await self.drive_call('get_folder_id', week_folder_name,
+                                                     self.project_folder_id)
             if not week_folder_id:
-                week_folder_id = self.drive_helper.create_folder(week_folder_name,
-                                                                 self.config.GOOGLE_DRIVE_PROJECT_FOLDER_ID)
+                week_folder_id = await self.drive_call('create_folder', week_folder_name,
+                                                         self.project_folder_id)
                 self.ui_handler.log_message(f"Week folder created with id: {week_folder_id}")
         except GoogleDriveHelperError as e:
             raise ScriptRunnerError(f"Error processing week folder: {e}") from e
         self.week_folder_id = week_folder_id
-        self.ui_handler.update_progress(10)
+        self.journal.update(week_folder_id=week_folder_id)
+        await self.checkpoint()
+        self.set_progress(10)
 
-    async def check_or_create_form(self, week_number):
+    async def find_form(self, week_number):
+        """Stops the run when the week's form already exists and isn't the one this run is building."""
         form_file_name = f'Weekly_Meals_Order_Week_{week_number}'
         try:
-            form_id = self.drive_helper.get_file_id(form_file_name, self.week_folder_id)
-            if form_id:
+            form_id = await self.drive_call('get_file_id', form_file_name, self.week_folder_id)
+            finished = self.journal.get('form_configured') and not self.journal.get('missing_days')
+            if form_id and (form_id != self.journal.get('form_id') or finished):
                 self.ui_handler.log_message(f"Form already exists with id: {form_id}")
-                form = self.forms_helper.get_form(form_id)
+                form = await self.forms_call('get_form', form_id)
                 form_id = form.get('formId')
-                self.ui_handler.log_message(
-                    f"Form already exists: {self.drive_helper.get_form_webViewLink(form_id)}")
+                self.form_id = form_id
+                web_view_link = await self.drive_call('get_form_webViewLink', form_id)
+                self.ui_handler.log_message(f"Form already exists: {web_view_link}")
                 self.ui_handler.log_message("Script finished - Form already exists")
-                return None
+                # Nothing to resume; a journal left behind would point a later run at stale IDs
+                self.journal.discard()
+                raise StopGraph()
+        except (GoogleDriveHelperError, GoogleFormsHelperError) as e:
+            raise ScriptRunnerError(f"Error checking form: {e}") from e
+
+    async def check_or_create_form(self, week_number):
+        form_file_name = f'Weekly_Meals_Order_Week_{week_number}'
+        journal_form_id = self.journal.get('form_id')
+        try:
+            if journal_form_id and not await self.form_still_exists(journal_form_id):
+                self.ui_handler.log_message(f"Form {journal_form_id} of the earlier run is gone, starting over")
+                self.journal.update(form_id=None, from_template=False, form_moved=False, permissions_set=False)
+                journal_form_id = None
+            if journal_form_id:
+                # Created by an earlier run that stopped before the form was complete
+                form_id = journal_form_id
+                self.resuming = True
+                self.ui_handler.log_message(f"Resuming unfinished form: {form_id}")
+            elif self.config.FORM_TEMPLATE_ID:
+                self.ui_handler.log_message("Form does not exist, copying the template.")
+                # The copy lands in the week folder under its final name, so there is nothing to move
+                form_id = await self.drive_call('copy_file', self.config.FORM_TEMPLATE_ID,
+                                                  form_file_name, self.week_folder_id)
+                self.journal.update(form_id=form_id, from_template=True, form_moved=True)
+                self.ui_handler.log_message(f"Form copied from the template: formId {form_id}")
             else:
                 self.ui_handler.log_message("Form does not exist, proceeding with creation.")
                 form_title = f'Meals Order for Week #{week_number}'
-                form = self.forms_helper.create_form(form_title)
+                form = await self.forms_call('create_form', form_title)
                 if form is None:
                     raise ScriptRunnerError("Failed to create form. Exiting.")
                 form_id = form['formId']
+                self.journal.update(form_id=form_id)
                 self.ui_handler.log_message(f"Empty Form Created: formId {form_id}")
                 self.ui_handler.log_message(f"Empty Form URL: {form.get('responderUri')}")
-                self.drive_helper.move_file(form_id, self.week_folder_id, self.drive_helper.get_root_folder_id(),
-                                            form_file_name)
-                self.set_form_permissions(form_id)
-                return form_id
+            self.form_id = form_id
+            await self.checkpoint()
+            return form_id
         except (GoogleDriveHelperError, GoogleFormsHelperError) as e:
             raise ScriptRunnerError(f"Error checking or creating form: {e}") from e
 
-    async def upload_and_process_images(self, selected_image_paths, form_id):
-        for i, day in enumerate(self.days):
-            file_name = f'{i + 1}.jpeg'
+    async def form_still_exists(self, form_id):
+        """Tells whether a form recorded in the journal can still be read; other errors propagate."""
+        try:
+            await self.forms_call('get_form', form_id)
+            return True
+        except GoogleFormsHelperError as e:
+            if error_status(e.__cause__) in (404, 410):
+                return False
+            raise
+
+    async def move_form(self, week_number):
+        """Moves the new form into the week folder; move_file reads its current parents itself."""
+        if self.journal.get('form_moved'):
+            return
+        try:
+            await self.drive_call('move_file', self.form_id, self.week_folder_id, None,
+                                    f'Weekly_Meals_Order_Week_{week_number}')
+        except GoogleDriveHelperError as e:
+            raise ScriptRunnerError(f"Error moving form: {e}") from e
+        self.journal.update(form_moved=True)
+
+    async def async_set_form_permissions(self):
+        if self.journal.get('permissions_set'):
+            return
+        await self.run_blocking(self.set_form_permissions, self.form_id)
+        self.journal.update(permissions_set=True)
+
+    async def upload_images(self, selected_image_paths):
+        """Uploads the day images not uploaded by an earlier run; a failed day doesn't stop the others."""
+        semaphore = asyncio.Semaphore(self.config.MAX_CONCURRENT_DAYS)
+        self.upload_progress = {day: (0, os.path.getsize(selected_image_paths[day])) for day in self.days}
+        digests = dict(zip(self.days, await asyncio.gather(
+            *(self.image_digest(selected_image_paths[day]) for day in self.days))))
+        saved_images = {day: self.journal.image(day, digests[day]) for day in self.days}
+        file_names = {day: self.image_file_name(day) for day in self.days}
+        pending = {day: selected_image_paths[day] for day in self.days if not saved_images[day]}
+        existing_files = {}
+        if self.config.UPLOAD_DEDUP_ENABLED and pending:
+            existing_files = await self.find_uploaded_images(pending, file_names)
+
+        async def upload(day):
+            if saved_images[day]:
+                self.upload_progress[day] = (self.upload_progress[day][1], self.upload_progress[day][1])
+                return saved_images[day]
+            existing_id, unchanged = existing_files.get(day, (None, False))
+            if unchanged:
+                self.upload_progress[day] = (self.upload_progress[day][1], self.upload_progress[day][1])
+                self.ui_handler.log_message(f"{file_names[day]} is already in the week folder, not uploading it")
+                self.journal.set_image(day, existing_id, digests[day])
+                return existing_id
+            async with semaphore:
+                with span(f"upload_day:{day}", 'day', day=day):
+                    file_id = await self.upload_day_image(day, selected_image_paths[day], file_names[day], existing_id)
+            self.journal.set_image(day, file_id, digests[day])
+            return file_id
+
+        results = await asyncio.gather(*(upload(day) for day in self.days), return_exceptions=True)
+        for day, result in zip(self.days, results):
+            if isinstance(result, BaseException):
+                self.ui_handler.log_message(f"Error uploading {day}: {result}", error=True)
+                continue
+            self.data[day]['image_id'] = result
+            self.day_finished(day)
+        await self.checkpoint()
+
+    async def image_digest(self, path):
+        """MD5 of an image, hashed once per run in the thread pool however many stages ask."""
+        if path not in self.image_digests:
+            self.image_digests[path] = asyncio.ensure_future(self.run_blocking(file_digest, path, 'md5'))
+        return await self.image_digests[path]
+
+    def image_file_name(self, day):
+        """Name of a day image in the week folder."""
+        return f'{self.days.index(day) + 1}.jpeg'
+
+    async def find_uploaded_images(self, image_paths, file_names, folder_id=None):
+        """Matches the images against the week folder (or folder_id) by name and MD5.
+
+        Returns day -> (file_id, unchanged) for every day whose file name is already in the
+        folder, so an identical image is reused and a changed one replaced in place. The
+        folder is listed once while the local files are hashed in the thread pool.
+        """
+        try:
+            listing, *digests = await asyncio.gather(
+                self.drive_call('list_folder_files', folder_id or self.week_folder_id),
+                *(self.image_digest(path) for path in image_paths.values()),
+            )
+        except (GoogleDriveHelperError, OSError) as e:
+            self.ui_handler.log_message(f"Could not check the week folder for uploaded images: {e}", error=True)
+            return {}
+        files_by_name = {}
+        for file in listing:
+            files_by_name.setdefault(file.get('name'), []).append(file)
+        matches = {}
+        for (day, path), digest in zip(image_paths.items(), digests):
+            candidates = files_by_name.get(file_names[day], [])
+            if not candidates:
+                continue
+            size = str(os.path.getsize(path))
+            identical = [file for file in candidates
+                         if file.get('md5Checksum') == digest and file.get('size') == size]
+            matches[day] = (identical[0]['id'], True) if identical else (candidates[0]['id'], False)
+        return matches
+
+    async def extract_menus(self, selected_image_paths):
+        """Extracts the menus not extracted by an earlier run, in one week request when enabled."""
+        semaphore = asyncio.Semaphore(self.config.MAX_CONCURRENT_DAYS)
+        digests = dict(zip(self.days, await asyncio.gather(
+            *(self.image_digest(selected_image_paths[day]) for day in self.days))))
+        saved_menus = {}
+        for day in self.days:
+            menu = self.journal.menu(day, digests[day])
+            # A menu journaled before menus were validated is extracted again
+            saved_menus[day] = menu if is_valid_menu(menu) else None
+        week_menus = {}
+        pending_menus = {day: path for day, path in selected_image_paths.items() if saved_menus[day] is None}
+        if self.config.GEMINI_BATCH_EXTRACTION and pending_menus:
+            week_menus = await self.async_get_week_menu_json(pending_menus)
+
+        async def extract(day):
+            if saved_menus[day] is not None:
+                return saved_menus[day]
+            if day in week_menus:
+                menu_data_str = week_menus[day]
+            else:
+                if self.config.GEMINI_BATCH_EXTRACTION:
+                    self.ui_handler.log_message(f"{day} missing from the week response, analyzing it separately.")
+                async with semaphore:
+                    with span(f"extract_day:{day}", 'day', day=day):
+                        menu_data_str = await self.async_get_menu_json(selected_image_paths[day], day)
             try:
-                uploaded_file_id = await self.async_upload_file(
-                    selected_image_paths[day], file_name, self.week_folder_id, 'image/jpeg'
-                )
-                self.data[day]['image_id'] = uploaded_file_id
-                if uploaded_file_id:
-                    self.ui_handler.log_message(f"Uploaded {file_name} to week folder as {file_name}")
-                    await asyncio.sleep(5)
-                    try:
-                        menu_data_str = await self.async_get_menu_json(uploaded_file_id)
-                        self.data[day]['menu'] = json.loads(menu_data_str)
-                    except (json.JSONDecodeError, GoogleGeminiHelperError) as e:
-                        raise ScriptRunnerError(f"Error processing menu for {day}: {e}") from e
-                else:
-                    self.ui_handler.log_message(f"Failed to upload {file_name} to the week folder.", error=True)
-            except ScriptRunnerError as e:
-                raise
-            except Exception as e:
-                raise ScriptRunnerError(f"Unexpected error processing images: {e}") from e
-            self.ui_handler.update_progress(10 + int((i + 1) * (90 / 5)))
-
-    async def async_upload_file(self, file_path, file_name, folder_id, mime_type):
-        """Asynchronously uploads a file."""
-        # Use asyncio-compatible method for file upload if possible
-        # This is a placeholder for demonstration
-        try:
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, self.drive_helper.upload_file, file_path, file_name, folder_id, mime_type)
+                menu = json.loads(menu_data_str)
+            except json.JSONDecodeError as e:
+                raise ScriptRunnerError(f"Error processing menu for {day}: {e}") from e
+            if not is_valid_menu(menu):
+                raise ScriptRunnerError(f"Error processing menu for {day}: not a list of dishes")
+            self.journal.set_menu(day, menu, digests[day])
+            return menu
+
+        results = await asyncio.gather(*(extract(day) for day in self.days), return_exceptions=True)
+        for day, result in zip(self.days, results):
+            if isinstance(result, BaseException):
+                self.ui_handler.log_message(f"Error extracting the menu of {day}: {result}", error=True)
+                continue
+            self.data[day]['menu'] = result
+            self.day_finished(day)
+        await self.checkpoint()
+
+    def day_finished(self, day):
+        """Counts a day once both its image and its menu are in."""
+        if self.data[day]['image_id'] and self.data[day]['menu'] is not None:
+            self.completed_days += 1
+            self.ui_handler.log_message(f"{day} processed ({self.completed_days}/{len(self.days)})")
+        self.report_progress()
+
+    def report_progress(self):
+        """Maps bytes uploaded and days processed onto the 10-90% range of the progress bar."""
+        sent = sum(sent for sent, _ in self.upload_progress.values())
+        total = sum(total for _, total in self.upload_progress.values()) or 1
+        fraction = 0.5 * sent / total + 0.5 * self.completed_days / len(self.days)
+        self.set_progress(10 + int(80 * fraction))
+
+    def _upload_progress_callback(self, day):
+        def callback(sent, total):
+            self.upload_progress[day] = (sent, total)
+            self.report_progress()
+        return callback
+
+    async def upload_day_image(self, day, image_path, file_name, existing_file_id=None):
+        """Uploads a day image, replacing existing_file_id if given, and waits until Drive can serve it."""
+        uploaded_file_id = await self.async_upload_file(image_path, file_name, self.week_folder_id, 'image/jpeg',
+                                                        self._upload_progress_callback(day), existing_file_id)
+        if not uploaded_file_id:
+            raise ScriptRunnerError(f"Failed to upload {file_name} to the week folder.")
+        if existing_file_id:
+            self.ui_handler.log_message(f"Replaced {file_name} in the week folder with the new image")
+        else:
+            self.ui_handler.log_message(f"Uploaded {file_name} to week folder as {file_name}")
+        await self.async_wait_for_file(uploaded_file_id)
+        return uploaded_file_id
+
+    async def async_wait_for_file(self, file_id):
+        """Asynchronously waits until an uploaded file is ready in Drive."""
+        try:
+            return await self.drive_call('wait_for_file_ready', file_id,
+                                           self.config.FILE_READY_TIMEOUT)
+        except GoogleDriveHelperError as e:
+            raise ScriptRunnerError(f"Error waiting for uploaded file: {e}") from e
+
+    async def async_upload_file(self, file_path, file_name, folder_id, mime_type, progress_callback=None,
+                                file_id=None):
+        """Asynchronously uploads a file, or replaces the content of file_id."""
+        try:
+            return await self.drive_call('upload_file', file_path, file_name, folder_id,
+                                           mime_type, progress_callback, file_id)
         except GoogleDriveHelperError as e:
             raise ScriptRunnerError(f"Error uploading file: {e}") from e
 
-    async def async_get_menu_json(self, file_id):
-        """Asynchronously gets menu data from Gemini."""
-        # Use asyncio-compatible method for network requests if possible
-        # This is a placeholder for demonstration
+    async def async_get_menu_json(self, file_path, day=None):
+        """Asynchronously gets menu data from Gemini for a local image."""
+        on_item = None
+        if self.config.GEMINI_STREAMING and day is not None:
+            def on_item(item):
+                self.ui_handler.log_message(f"{day}: {item.get('name')} {item.get('allergens', '')}".rstrip())
         try:
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, self.gemini_helper.get_menu_json_from_drive_id, file_id)
+            return await self.run_blocking(self.gemini_helper.get_menu_json_from_file, file_path, on_item)
         except GoogleGeminiHelperError as e:
             raise ScriptRunnerError(f"Error getting menu data: {e}") from e
 
+    async def async_get_week_menu_json(self, file_paths):
+        """Asynchronously gets the menus of all days from a single Gemini request."""
+        try:
+            return await self.run_blocking(self.gemini_helper.get_week_menu_json_from_files,
+                                           dict(file_paths))
+        except GoogleGeminiHelperError as e:
+            self.ui_handler.log_message(f"Week request failed, analyzing days separately: {e}", error=True)
+            return {}
+
     def set_form_permissions(self, form_id):
         try:
             batch = self.drive_helper.drive_service.new_batch_http_request()
@@ -162,33 +608,96 @@ class ScriptRunner:
                         **({'transferOwnership': True} if permission['role'] == 'owner' else {}),
                     )
                 )
-            batch.execute()
-            self.drive_helper.drive_service.permissions().create(
+            self.drive_helper.execute(batch)
+            self.drive_helper.execute_small(self.drive_helper.drive_service.permissions().create(
                 fileId=form_id,
                 body={'type': 'user', 'role': 'owner', 'emailAddress': self.config.YOUR_EMAIL},
                 fields='id',
                 transferOwnership=True
-            ).execute()
+            ))
         except Exception as e:
             raise ScriptRunnerError(f"Error setting form permissions: {e}") from e
 
-    async def configure_form(self, form_id):
-        try:
-            for day, data in reversed(self.data.items()):
-                if not data['menu'] or not data['image_id']:
-                    self.ui_handler.log_message(f"Skipping {day} due to missing menu or image data.", error=True)
-                    continue
-                image_id = data['image_id']
-                image_url = f'https://drive.google.com/uc?id={image_id}'
-                requests = self.create_form_update_requests(day, image_url, data['menu'])
-                self.ui_handler.log_message(f"{form_id}: Adding {day}")
-                self.forms_helper.update_form(form_id, requests)
-                self.ui_handler.log_message(f"{form_id}: {day} Added")
+    async def configure_form(self):
+        form_id = self.form_id
+        days_added = []
+        for day, data in self.data.items():
+            if not data['menu'] or not data['image_id']:
+                self.ui_handler.log_message(f"Skipping {day} due to missing menu or image data.", error=True)
+                self.missing_days.append(day)
+                continue
+            days_added.append(day)
+        if not days_added:
+            raise ScriptRunnerError("Error: No menu could be processed.")
+        try:
+            existing_items = []
+            from_template = self.journal.get('from_template')
+            if self.resuming or from_template:
+                form = await self.forms_call('get_form', form_id)
+                existing_items = form.get('items', [])
+            if from_template and self.template_layout_matches(existing_items):
+                requests = self.create_template_update_requests(self.week_number)
+                self.ui_handler.log_message(f"{form_id}: Filling in {len(days_added)} days of the template")
+            else:
+                if from_template:
+                    self.ui_handler.log_message(f"{form_id}: Template layout not recognized, rebuilding the items")
+                requests = []
+                for day in days_added:
+                    image_url = f'https://drive.google.com/uc?id={self.data[day]["image_id"]}'
+                    requests.extend(self.create_form_update_requests(day, image_url, self.data[day]['menu'],
+                                                                     len(requests)))
+                if existing_items:
+                    # Drop whatever an interrupted earlier run managed to add, then rebuild the item list
+                    self.ui_handler.log_message(f"{form_id}: Replacing {len(existing_items)} items from the earlier run")
+                    requests = [{'deleteItem': {'location': {'index': 0}}}] * len(existing_items) + requests
+                self.ui_handler.log_message(f"{form_id}: Adding {len(days_added)} days")
+            await self.forms_call('update_form', form_id, requests)
+            self.ui_handler.log_message(f"{form_id}: Days Added")
         except GoogleFormsHelperError as e:
             raise ScriptRunnerError(f"Error configuring form: {e}") from e
 
-    def create_form_update_requests(self, day, image_url, menu):
-        """Creates form update requests for a given day."""
+    def template_layout_matches(self, items):
+        """Tells whether items are laid out per day as an image item followed by two questions."""
+        if len(items) != ITEMS_PER_DAY * len(self.days):
+            return False
+        return all('imageItem' in item if index % ITEMS_PER_DAY == 0 else 'questionItem' in item
+                   for index, item in enumerate(items))
+
+    def create_template_update_requests(self, week_number):
+        """Patches a copied template: the title, then per day the image and the choice options.
+
+        The template holds, for every day in order, an image item, the soup question and the
+        main course question. Images can't be changed in place, so each one is deleted and
+        created again; days without data are removed. Days are patched from the last one
+        so deletions don't shift the items still to be patched.
+        """
+        requests = [{'updateFormInfo': {'info': {'title': f'Meals Order for Week #{week_number}'},
+                                        'updateMask': 'title'}}]
+        for position in reversed(range(len(self.days))):
+            day = self.days[position]
+            data = self.data[day]
+            index = position * ITEMS_PER_DAY
+            if not data['menu'] or not data['image_id']:
+                requests.extend([{'deleteItem': {'location': {'index': index}}}] * ITEMS_PER_DAY)
+                continue
+            image_url = f'https://drive.google.com/uc?id={data["image_id"]}'
+            image_item, soup_item, main_item = self.create_form_update_requests(day, image_url, data['menu'], index)
+            requests.append({'deleteItem': {'location': {'index': index}}})
+            requests.append(image_item)
+            for offset, question_item in ((1, soup_item), (2, main_item)):
+                item = question_item['createItem']['item']
+                requests.append({
+                    'updateItem': {
+                        'item': {'title': item['title'], 'questionItem': {'question': {
+                            'choiceQuestion': item['questionItem']['question']['choiceQuestion']}}},
+                        'location': {'index': index + offset},
+                        'updateMask': 'title,questionItem.question.choiceQuestion',
+                    }
+                })
+        return requests
+
+    def create_form_update_requests(self, day, image_url, menu, start_index=0):
+        """Creates form update requests for a given day, placed from start_index on."""
         return [
             {
                 'createItem': {
@@ -196,7 +705,7 @@ class ScriptRunner:
                         'title': ' ',
                         'imageItem': {'image': {'sourceUri': image_url}}
                     },
-                    'location': {'index': 0},
+                    'location': {'index': start_index},
                 }
             },
             {
@@ -213,7 +722,7 @@ class ScriptRunner:
                             }
                         },
                     },
-                    'location': {'index': 1},
+                    'location': {'index': start_index + 1},
                 }
             },
             {
@@ -230,7 +739,7 @@ class ScriptRunner:
                             }
                         },
                     },
-                    'location': {'index': 2},
+                    'location': {'index': start_index + 2},
                 }
             },
         ]
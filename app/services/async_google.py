@@ -0,0 +1,470 @@
+import asyncio
+import importlib.util
+import os
+import time
+from app.core.auth import get_credential_manager
+from app.core.scheduler import error_status
+from app.core.tracing import add_to_span, payload_size, traced_async
+from app.core.utils import handle_error, logging, mapped_file, release_pages
+from app.services.drive_index import FOLDER_MIME_TYPE
+from app.services.gdrive import (DEFAULT_UPLOAD_CHUNK_SIZE, FORM_MIME_TYPE, RESUME_INCOMPLETE,
+                                 UPLOAD_CHUNK_ALIGNMENT, GoogleDriveHelperError)
+from app.services.gforms import MAX_BATCH_UPDATE_BYTES, GoogleFormsHelper, GoogleFormsHelperError
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DRIVE_URL = 'https://www.googleapis.com/drive/v3'
+DRIVE_UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3'
+FORMS_URL = 'https://forms.googleapis.com/v1'
+
+def async_http_available():
+    """Tells whether the optional httpx dependency is installed."""
+    return httpx is not None
+
+class AsyncGoogleClientError(Exception):
+    """Custom exception for AsyncGoogleClient errors."""
+    pass
+
+class AsyncHttpError(Exception):
+    """An error status from a Google API, shaped like googleapiclient's HttpError for the scheduler."""
+
+    def __init__(self, response):
+        self.resp = _ErrorResponse({name.lower(): value for name, value in response.headers.items()})
+        self.resp.status = response.status_code
+        self.content = response.content
+        super().__init__(f"<HttpError {response.status_code} when requesting {response.request.url} "
+                         f"returned \"{response.text[:200]}\">")
+
+class _ErrorResponse(dict):
+    """Response headers with the status attached, like an httplib2 response."""
+    status = None
+
+class AsyncTransportError(ConnectionError):
+    """A request that never got a response; retried like any connection error."""
+    pass
+
+class AsyncGoogleClient:
+    """Sends Google API requests from the event loop over one pooled connection set.
+
+    Connections are kept alive between requests and use HTTP/2 when the h2 package is
+    installed, so concurrent calls share a few connections. The client belongs to the
+    event loop it was first used on; close it with aclose before that loop ends. Tokens
+    come from the process-wide credential manager, which also does every refresh. A
+    transport other than the network, e.g. an httpx.MockTransport, can be passed in.
+    """
+
+    def __init__(self, config, timeout=60, max_connections=20, transport=None):
+        if httpx is None:
+            raise AsyncGoogleClientError("The async HTTP client needs the httpx package")
+        self.credential_manager = get_credential_manager(config)
+        self.http2 = importlib.util.find_spec('h2') is not None
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    async def _token(self):
+        """Returns the access token of the shared credentials."""
+        credentials = await self.credential_manager.get_credentials_async()
+        return credentials.token
+
+    async def request(self, method, url, params=None, json=None, content=None, headers=None):
+        """Sends one request; error statuses raise AsyncHttpError, a 308 is returned as is."""
+        headers = dict(headers or {})
+        headers['Authorization'] = f"Bearer {await self._token()}"
+        try:
+            response = await self.client.request(method, url, params=params, json=json, content=content,
+                                                 headers=headers)
+        except httpx.TransportError as e:
+            raise AsyncTransportError(f"{method} {url} failed: {e}") from e
+        if response.status_code >= 400:
+            raise AsyncHttpError(response)
+        return response
+
+    async def json(self, method, url, **kwargs):
+        """Sends one request and returns its decoded JSON body."""
+        response = await self.request(method, url, **kwargs)
+        return response.json() if response.content else {}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+class AsyncGoogleDriveHelper:
+    """Async counterpart of GoogleDriveHelper for the calls made while a week is built.
+
+    Shares the scheduler (quotas and retries), the upload session store and the Drive
+    index with the thread-based helper, so both can be used in the same run.
+    """
+
+    def __init__(self, client, scheduler=None, upload_sessions=None, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE,
+                 index=None):
+        self.client = client
+        self.scheduler = scheduler
+        self.upload_sessions = upload_sessions
+        self.chunk_size = max(UPLOAD_CHUNK_ALIGNMENT, chunk_size // UPLOAD_CHUNK_ALIGNMENT * UPLOAD_CHUNK_ALIGNMENT)
+        self.index = index
+
+    async def execute(self, method_id, send, idempotent=True, probe=None):
+        """Awaits send() under the shared quota and retry policy."""
+        if self.scheduler is None:
+            return await send()
+        return await self.scheduler.call_async('drive', send, idempotent=idempotent, probe=probe,
+                                               method_id=method_id)
+
+    async def call(self, method_id, method, path, idempotent=True, probe=None, base=DRIVE_URL, **kwargs):
+        """Sends a Drive JSON request and returns its decoded response."""
+        add_to_span(bytes_sent=payload_size(kwargs.get('json')))
+        response = await self.execute(method_id, lambda: self.client.json(method, base + path, **kwargs),
+                                      idempotent=idempotent, probe=probe)
+        add_to_span(bytes_received=payload_size(response))
+        return response
+
+    def _indexed(self, parent_folder_id):
+        return self.index is not None and parent_folder_id is not None and self.index.covers(parent_folder_id)
+
+    async def _record(self, file_id, name, mime_type, parents):
+        # Recording saves the index file, so it runs off the event loop
+        if self.index is not None and file_id:
+            await asyncio.to_thread(self.index.record, file_id, name, mime_type, parents)
+
+    async def _find(self, query, fields='files(id, name)'):
+        response = await self.call('drive.files.list', 'GET', '/files', params={'q': query, 'fields': fields})
+        return response.get('files') or []
+
+    async def _probe_created(self, name, parent_folder_id, mime_type):
+        """Looks up, bypassing the index, a file that a failed create may have produced."""
+        query = f"name='{name}' and mimeType='{mime_type}' and trashed=false"
+        if parent_folder_id:
+            query += f" and '{parent_folder_id}' in parents"
+        files = await self.client.json('GET', DRIVE_URL + '/files', params={'q': query, 'fields': 'files(id)'})
+        files = files.get('files')
+        return {'id': files[0]['id']} if files else None
+
+    @traced_async('drive')
+    async def get_folder_id(self, folder_name, parent_folder_id=None):
+        """Retrieves the ID of a folder by its name."""
+        if self._indexed(parent_folder_id):
+            folder_id = self.index.find(folder_name, parent_folder_id, FOLDER_MIME_TYPE)
+            logging.info(f"Folder id from index: {folder_id}")
+            return folder_id
+        try:
+            query = f"name='{folder_name}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+            if parent_folder_id:
+                query += f" and '{parent_folder_id}' in parents"
+            folder = await self._find(query)
+            if folder:
+                folder_id = folder[0].get('id')
+                logging.info(f"Folder id: {folder_id}")
+                return folder_id
+            logging.warning(f"Folder not found: {folder_name}")
+            return None
+        except Exception as e:
+            handle_error(f"Error getting folder ID for '{folder_name}'", e)
+            raise GoogleDriveHelperError(f"Could not get folder ID: {e}") from e
+
+    @traced_async('drive')
+    async def create_folder(self, folder_name, parent_folder_id=None):
+        """Creates a new folder with the given name."""
+        try:
+            file_metadata = {'name': folder_name, 'mimeType': FOLDER_MIME_TYPE}
+            if parent_folder_id:
+                file_metadata['parents'] = [parent_folder_id]
+            folder = await self.call(
+                'drive.files.create', 'POST', '/files', params={'fields': 'id'}, json=file_metadata,
+                idempotent=False,
+                probe=lambda: self._probe_created(folder_name, parent_folder_id, FOLDER_MIME_TYPE),
+            )
+            folder_id = folder.get('id')
+            await self._record(folder_id, folder_name, FOLDER_MIME_TYPE, file_metadata.get('parents', []))
+            logging.info(f"Folder created with id: {folder_id}")
+            return folder_id
+        except Exception as e:
+            handle_error(f"Error creating folder '{folder_name}'", e)
+            raise GoogleDriveHelperError(f"Could not create folder: {e}") from e
+
+    @traced_async('drive')
+    async def get_file_id(self, file_name, parent_folder_id=None):
+        """Retrieves the ID of a file by its name."""
+        if self._indexed(parent_folder_id):
+            file_id = self.index.find(file_name, parent_folder_id)
+            logging.info(f"File id from index: {file_id}")
+            return file_id
+        try:
+            query = f"name='{file_name}' and trashed=false"
+            if parent_folder_id:
+                query += f" and '{parent_folder_id}' in parents"
+            file = await self._find(query)
+            if file:
+                file_id = file[0].get('id')
+                logging.info(f"File id: {file_id}")
+                return file_id
+            logging.warning(f"File not found: {file_name}")
+            return None
+        except Exception as e:
+            handle_error(f"Error getting file ID for '{file_name}'", e)
+            raise GoogleDriveHelperError(f"Could not get file ID: {e}") from e
+
+    @traced_async('drive')
+    async def list_folder_files(self, folder_id, fields='id, name, md5Checksum, size'):
+        """Lists the files directly in a folder, following every page."""
+        try:
+            files = []
+            params = {'q': f"'{folder_id}' in parents and trashed=false",
+                      'fields': f'nextPageToken, files({fields})', 'pageSize': 1000}
+            while True:
+                response = await self.call('drive.files.list', 'GET', '/files', params=dict(params))
+                files.extend(response.get('files', []))
+                params['pageToken'] = response.get('nextPageToken')
+                if not params['pageToken']:
+                    return files
+        except Exception as e:
+            handle_error(f"Error listing folder '{folder_id}'", e)
+            raise GoogleDriveHelperError(f"Could not list folder: {e}") from e
+
+    @traced_async('drive')
+    async def move_file(self, file_id, new_parent_folder_id, old_parent_folder_id=None, new_name=None):
+        """Moves a file to a new folder, out of all its current parents."""
+        logging.info(f"Moving file: {file_id} to folder: {new_parent_folder_id}")
+        try:
+            file = await self.call('drive.files.get', 'GET', f'/files/{file_id}', params={'fields': 'parents, name'})
+            file_metadata = {'name': new_name} if new_name else {}
+            file = await self.call('drive.files.update', 'PATCH', f'/files/{file_id}', json=file_metadata, params={
+                'addParents': new_parent_folder_id,
+                'removeParents': ",".join(file.get('parents')),
+                'fields': 'id, name, mimeType, parents',
+            })
+            await self._record(file.get('id'), file.get('name'), file.get('mimeType'), file.get('parents', []))
+            logging.info(f"File moved with id: {file.get('id')}")
+            return file.get('id')
+        except Exception as e:
+            handle_error(f"Error moving file '{file_id}'", e)
+            raise GoogleDriveHelperError(f"Could not move file: {e}") from e
+
+    @traced_async('drive')
+    async def copy_file(self, file_id, new_name, parent_folder_id, mime_type=FORM_MIME_TYPE):
+        """Copies a file, e.g. a template form, into a folder under a new name."""
+        logging.info(f"Copying file: {file_id} to folder: {parent_folder_id} as {new_name}")
+        try:
+            file = await self.call(
+                'drive.files.copy', 'POST', f'/files/{file_id}/copy', params={'fields': 'id'},
+                json={'name': new_name, 'parents': [parent_folder_id]},
+                idempotent=False,
+                probe=lambda: self._probe_created(new_name, parent_folder_id, mime_type),
+            )
+            await self._record(file.get('id'), new_name, mime_type, [parent_folder_id])
+            logging.info(f"File copied with id: {file.get('id')}")
+            return file.get('id')
+        except Exception as e:
+            handle_error(f"Error copying file '{file_id}'", e)
+            raise GoogleDriveHelperError(f"Could not copy file: {e}") from e
+
+    @traced_async('drive')
+    async def get_form_webViewLink(self, form_id):
+        """Retrieves the webViewLink of a form by its ID."""
+        logging.info(f"Getting webViewLink for form: {form_id}")
+        try:
+            file = await self.call('drive.files.get', 'GET', f'/files/{form_id}', params={'fields': 'webViewLink'})
+            webViewLink = file.get('webViewLink')
+            logging.info(f"webViewLink: {webViewLink}")
+            return webViewLink
+        except Exception as e:
+            handle_error(f"Error getting webViewLink for form '{form_id}'", e)
+            raise GoogleDriveHelperError(f"Could not get webViewLink: {e}") from e
+
+    @traced_async('drive')
+    async def folder_exists(self, folder_id):
+        """Tells whether a folder can still be read and is not in the trash."""
+        try:
+            file = await self.call('drive.files.get', 'GET', f'/files/{folder_id}', params={'fields': 'id, trashed'})
+            return not file.get('trashed')
+        except Exception as e:
+            if error_status(e) == 404:
+                return False
+            handle_error(f"Error checking folder '{folder_id}'", e)
+            raise GoogleDriveHelperError(f"Could not check folder: {e}") from e
+
+    @traced_async('drive')
+    async def wait_for_file_ready(self, file_id, timeout=30, interval=0.5):
+        """Waits until Drive reports the content of an uploaded file as stored."""
+        logging.info(f"Waiting for file to be ready: {file_id}")
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                file = await self.call('drive.files.get', 'GET', f'/files/{file_id}', params={'fields': 'id, size'})
+                if file.get('size'):
+                    logging.info(f"File ready: {file_id} ({file.get('size')} bytes)")
+                    return True
+                if time.monotonic() + interval > deadline:
+                    raise GoogleDriveHelperError(f"File {file_id} not ready after {timeout}s")
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, 5)
+        except GoogleDriveHelperError:
+            raise
+        except Exception as e:
+            handle_error(f"Error checking readiness of file '{file_id}'", e)
+            raise GoogleDriveHelperError(f"Could not check file readiness: {e}") from e
+
+    @traced_async('drive')
+    async def upload_file(self, file, file_name, parent_folder_id, mime_type, progress_callback=None, file_id=None):
+        """Uploads a file in resumable chunks, like GoogleDriveHelper.upload_file."""
+        logging.info(f"Uploading file: {file_name} to folder: {parent_folder_id}")
+        try:
+            session_key = None
+            if self.upload_sessions is not None:
+                # Same key as the thread-based helper, so either one can resume the other's upload;
+                # it hashes the whole file, so it runs off the event loop like the session file I/O
+                target = f"{parent_folder_id}/{file_id}" if file_id else parent_folder_id
+                session_key = await asyncio.to_thread(self.upload_sessions.key_for, file, file_name, target)
+            try:
+                uploaded = await self._upload_in_chunks(file, file_name, parent_folder_id, mime_type,
+                                                        session_key, progress_callback, file_id)
+            except AsyncHttpError as e:
+                # The saved session expired or was discarded by the server: start over once
+                if session_key is None or e.resp.status not in (404, 410):
+                    raise
+                logging.warning(f"Upload session for {file_name} expired, restarting upload")
+                await asyncio.to_thread(self.upload_sessions.remove, session_key)
+                uploaded = await self._upload_in_chunks(file, file_name, parent_folder_id, mime_type,
+                                                        session_key, progress_callback, file_id)
+            if session_key is not None:
+                await asyncio.to_thread(self.upload_sessions.remove, session_key)
+            await self._record(uploaded.get('id'), file_name, mime_type, [parent_folder_id])
+            logging.info(f"File uploaded with id: {uploaded.get('id')}")
+            return uploaded.get('id')
+        except Exception as e:
+            handle_error(f"Error uploading file '{file_name}'", e)
+            raise GoogleDriveHelperError(f"Could not upload file: {e}") from e
+
+    async def _start_upload(self, file_name, parent_folder_id, mime_type, total, file_id):
+        """Opens a resumable upload session and returns its URI."""
+        headers = {'X-Upload-Content-Type': mime_type, 'X-Upload-Content-Length': str(total)}
+        if file_id:
+            method, path, metadata, method_id = 'PATCH', f'/files/{file_id}', {}, 'drive.files.update'
+        else:
+            method, path, method_id = 'POST', '/files', 'drive.files.create'
+            metadata = {'name': file_name, 'parents': [parent_folder_id]}
+        # Opening a session creates nothing, so it is safe to retry
+        response = await self.execute(method_id, lambda: self.client.request(
+            method, DRIVE_UPLOAD_URL + path, params={'uploadType': 'resumable', 'fields': 'id'},
+            json=metadata, headers=headers))
+        return response.headers['Location']
+
+    async def _send_range(self, session_uri, content, offset, total):
+        """Sends bytes from offset (none to only ask for the status); returns (offset, file or None)."""
+        if content:
+            content_range = f"bytes {offset}-{offset + len(content) - 1}/{total}"
+        else:
+            content_range = f"bytes */{total}"
+        response = await self.client.request('PUT', session_uri, content=content,
+                                             headers={'Content-Range': content_range})
+        if response.status_code != RESUME_INCOMPLETE:
+            return total, response.json()
+        received = response.headers.get('Range')
+        return (int(received.rsplit('-', 1)[1]) + 1 if received else 0), None
+
+    async def _upload_in_chunks(self, file, file_name, parent_folder_id, mime_type, session_key, progress_callback,
+                                file_id=None):
+        total = os.path.getsize(file)
+        session_uri = None
+        if session_key is not None:
+            session_uri = await asyncio.to_thread(self.upload_sessions.get, session_key)
+        state = {'offset': 0, 'stale': bool(session_uri)}
+        if session_uri:
+            logging.info(f"Resuming upload of {file_name}")
+        else:
+            session_uri = await self._start_upload(file_name, parent_folder_id, mime_type, total, file_id)
+            if session_key is not None:
+                await asyncio.to_thread(self.upload_sessions.save, session_key, session_uri)
+
+        with mapped_file(file) as source:
+            async def send_chunk():
+                # After a failure, ask the server how many bytes it kept before sending more
+                if state['stale']:
+                    state['offset'], uploaded = await self._send_range(session_uri, b'', 0, total)
+                    state['stale'] = False
+                    if uploaded is not None:
+                        return uploaded
+                chunk = source[state['offset']:state['offset'] + self.chunk_size]
+                try:
+                    state['offset'], uploaded = await self._send_range(session_uri, chunk, state['offset'], total)
+                except Exception:
+                    state['stale'] = True
+                    raise
+                return uploaded
+
+            while True:
+                sent_before = state['offset']
+                uploaded = await self.execute('drive.files.upload', send_chunk)
+                add_to_span(bytes_sent=state['offset'] - sent_before, bytes_received=payload_size(uploaded))
+                # Sent bytes are not read again unless the server asks for them after a failure
+                release_pages(source, sent_before, state['offset'] - sent_before)
+                if uploaded is not None:
+                    break
+                if progress_callback:
+                    progress_callback(state['offset'], total)
+        if progress_callback:
+            progress_callback(total, total)
+        return uploaded
+
+class AsyncGoogleFormsHelper:
+    """Async counterpart of GoogleFormsHelper."""
+
+    def __init__(self, client, scheduler=None):
+        self.client = client
+        self.scheduler = scheduler
+
+    async def call(self, method_id, method, path, idempotent=True, **kwargs):
+        """Sends a Forms JSON request under the shared quota and retry policy."""
+        add_to_span(bytes_sent=payload_size(kwargs.get('json')))
+        send = lambda: self.client.json(method, FORMS_URL + path, **kwargs)
+        if self.scheduler is None:
+            response = await send()
+        else:
+            response = await self.scheduler.call_async('forms', send, idempotent=idempotent, method_id=method_id)
+        add_to_span(bytes_received=payload_size(response))
+        return response
+
+    @traced_async('forms')
+    async def create_form(self, title):
+        """Creates a new Google Form with the given title."""
+        try:
+            form = await self.call('forms.forms.create', 'POST', '/forms', json={'info': {'title': title}},
+                                   idempotent=False)
+            logging.info(f"{form.get('formId')}: Form created")
+            return form
+        except Exception as e:
+            handle_error(f"Error creating form with title '{title}'", e)
+            raise GoogleFormsHelperError(f"Could not create form: {e}") from e
+
+    @traced_async('forms')
+    async def get_form(self, form_id):
+        """Retrieves a Google Form by its ID."""
+        try:
+            return await self.call('forms.forms.get', 'GET', f'/forms/{form_id}')
+        except Exception as e:
+            handle_error(f"Error getting form with ID {form_id}", e)
+            raise GoogleFormsHelperError(f"Could not get form: {e}") from e
+
+    @traced_async('forms')
+    async def update_form(self, form_id, requests, max_body_bytes=MAX_BATCH_UPDATE_BYTES):
+        """Updates a Google Form with the given requests, in as few batchUpdate calls as fit the size limit."""
+        try:
+            replies = []
+            form = None
+            for chunk in GoogleFormsHelper._chunk_requests(requests, max_body_bytes):
+                # createItem is not idempotent, so this is only retried when the quota rejected it
+                form = await self.call('forms.forms.batchUpdate', 'POST', f'/forms/{form_id}:batchUpdate',
+                                       json={'requests': chunk}, idempotent=False)
+                replies.extend(form.get('replies', []))
+            logging.info(f"{form_id}: Form updated")
+            if form is not None:
+                form['replies'] = replies
+            return form
+        except Exception as e:
+            handle_error(f"Error updating form with ID {form_id}", e)
+            raise GoogleFormsHelperError(f"Could not update form: {e}") from e
@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+import time
+import httplib2
+import google_auth_httplib2
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.http import HttpRequest
+from app.core.utils import logging
+
+def _discovery_dir():
+    """Returns the directory holding discovery documents bundled with the app."""
+    if getattr(sys, 'frozen', False):
+        application_path = sys._MEIPASS
+    else:
+        application_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(application_path, "app", "assets", "discovery")
+
+class GoogleClientFactory:
+    """Builds Google API clients once per process and shares one authorized transport per thread.
+
+    Discovery documents come from app/assets/discovery when present, otherwise from the copies
+    shipped with google-api-python-client, so building a client never hits the network.
+    httplib2 connections are not thread-safe, so each worker thread gets its own pooled
+    transport, reused by every client and every run on that thread. The credentials from
+    GoogleAuth leave the transports' token refreshes to the shared CredentialManager.
+    """
+
+    def __init__(self, credentials, timeout=60):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.services = {}
+        self.timings = {}
+        self.created_at = time.perf_counter()
+        self.first_request_at = None
+        self._generation = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def set_credentials(self, credentials):
+        """Switches to new credentials; transports are rebuilt lazily on each thread."""
+        with self._lock:
+            if credentials is not self.credentials:
+                self.credentials = credentials
+                self._generation += 1
+
+    def http(self):
+        """Returns the authorized transport of the calling thread."""
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            local.http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials, http=httplib2.Http(timeout=self.timeout)
+            )
+            local.generation = self._generation
+        return local.http
+
+    def async_transport(self):
+        """Returns the httpx transport of the async client; None sends its requests over the network."""
+        return None
+
+    def _request_builder(self, http, *args, **kwargs):
+        if self.first_request_at is None:
+            self.first_request_at = time.perf_counter()
+            self.timings['cold_start_to_first_request'] = self.first_request_at - self.created_at
+            logging.info(f"Cold start to first Google API request: "
+                         f"{self.timings['cold_start_to_first_request']:.3f}s")
+        return HttpRequest(self.http(), *args, **kwargs)
+
+    def get(self, service_name, version):
+        """Returns the shared client for a Google API, building it on first use."""
+        key = (service_name, version)
+        with self._lock:
+            service = self.services.get(key)
+            if service is None:
+                start = time.perf_counter()
+                service = self._build(service_name, version)
+                self.timings[f'build_{service_name}_{version}'] = time.perf_counter() - start
+                logging.info(f"Built {service_name} {version} client in "
+                             f"{self.timings[f'build_{service_name}_{version}']:.3f}s")
+                self.services[key] = service
+        return service
+
+    def _build(self, service_name, version):
+        document_path = os.path.join(_discovery_dir(), f"{service_name}.{version}.json")
+        if os.path.exists(document_path):
+            with open(document_path, "r", encoding="utf-8") as document_file:
+                return build_from_document(document_file.read(), http=self.http(),
+                                           requestBuilder=self._request_builder)
+        return build(service_name, version, http=self.http(), requestBuilder=self._request_builder,
+                     static_discovery=True, cache_discovery=False)
+
+_factory = None
+_factory_lock = threading.Lock()
+
+def get_client_factory(credentials):
+    """Returns the process-wide client factory, bound to the given credentials."""
+    global _factory
+    with _factory_lock:
+        if _factory is None:
+            _factory = GoogleClientFactory(credentials)
+        else:
+            _factory.set_credentials(credentials)
+        return _factory
@@ -0,0 +1,124 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from app.core.scheduler import is_transient
+from app.core.utils import logging
+
+# Drive accepts at most 100 calls in one batch request
+MAX_BATCH_SIZE = 100
+
+class DriveRequestCoalescer:
+    """Sends small Drive requests made at about the same time as one batch HTTP request.
+
+    Each caller submits its own request and blocks on its own result. The first request
+    of a batch waits up to `window` seconds for others to join it. Batches are sent from
+    a small pool of threads, each with its own transport. An item that fails with a
+    transient error is retried on its own; any other error goes back to its caller.
+    Only submit requests that are safe to repeat, since a failed batch is retried whole.
+    A batch takes one quota token per call in it, and is sent in the context of its first
+    caller, e.g. its trace; a retried call runs in the context of its own caller.
+    """
+
+    def __init__(self, drive_service, scheduler=None, http=None, window=0.02, max_batch_size=MAX_BATCH_SIZE,
+                 max_senders=4):
+        self.drive_service = drive_service
+        self.scheduler = scheduler
+        self.http = http
+        self.window = window
+        self.max_batch_size = min(max_batch_size, MAX_BATCH_SIZE)
+        self.pending = []
+        self.condition = threading.Condition()
+        self.collector = None
+        self.senders = ThreadPoolExecutor(max_workers=max_senders, thread_name_prefix='drive-batch')
+
+    def call(self, request):
+        """Executes request as part of the next batch and returns its response."""
+        return self.submit(request).result()
+
+    def submit(self, request):
+        future = Future()
+        with self.condition:
+            self.pending.append((request, future, contextvars.copy_context()))
+            if self.collector is None:
+                self.collector = threading.Thread(target=self._collect, name='drive-batch-collector', daemon=True)
+                self.collector.start()
+            self.condition.notify()
+        return future
+
+    def _collect(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = time.monotonic() + self.window
+                while len(self.pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                items = self.pending[:self.max_batch_size]
+                del self.pending[:self.max_batch_size]
+            # A copy, so the first item can still run in its own context if it is retried
+            self.senders.submit(items[0][2].copy().run, self._send, items)
+
+    def _run(self, fn, cost=1):
+        kwargs = {'http': self.http()} if self.http else {}
+        if self.scheduler is None:
+            return fn(**kwargs)
+        return self.scheduler.call('drive', fn, cost=cost, **kwargs)
+
+    def _send(self, items):
+        if len(items) == 1:
+            request, future, _ = items[0]
+            self._send_one(request, future)
+            return
+
+        retry = []
+
+        def callback(request_id, response, exception):
+            request, future, context = items[int(request_id)]
+            if future.done():
+                return
+            if exception is None:
+                future.set_result(response)
+            elif is_transient(exception):
+                retry.append((request, future, context))
+            else:
+                future.set_exception(exception)
+
+        batch = self.drive_service.new_batch_http_request(callback=callback)
+        for position, (request, _, _) in enumerate(items):
+            batch.add(request, request_id=str(position))
+        try:
+            self._run(batch.execute, cost=len(items))
+        except Exception as e:
+            for _, future, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if retry:
+            logging.info(f"Retrying {len(retry)} of {len(items)} batched Drive calls on their own")
+        for request, future, context in retry:
+            context.run(self._send_one, request, future)
+        for _, future, _ in items:
+            if not future.done():
+                future.set_exception(RuntimeError("Drive batch returned no response for this call"))
+
+    def _send_one(self, request, future):
+        try:
+            future.set_result(self._run(request.execute))
+        except Exception as e:
+            future.set_exception(e)
+
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+def get_request_coalescer(drive_service, scheduler=None, http=None, window=0.02):
+    """Returns the process-wide coalescer of a Drive client, so concurrent runs share batches."""
+    with _coalescers_lock:
+        coalescer = _coalescers.get(id(drive_service))
+        if coalescer is None or coalescer.drive_service is not drive_service:
+            coalescer = DriveRequestCoalescer(drive_service, scheduler, http, window)
+            _coalescers[id(drive_service)] = coalescer
+        return coalescer
@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+from app.core.utils import handle_error, logging, write_atomic
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+FILE_FIELDS = 'id, name, mimeType, parents, trashed'
+
+class DriveFolderIndexError(Exception):
+    """Custom exception for DriveFolderIndex errors."""
+    pass
+
+class DriveFolderIndex:
+    """Local name -> ID index of a Drive folder tree, kept fresh with the changes feed.
+
+    Use get_drive_index to get one, so every run in a process shares the same instance
+    and index file. Refreshes are serialized; lookups can run meanwhile.
+    """
+
+    def __init__(self, drive_service, root_folder_id, index_path, execute=None):
+        self.drive_service = drive_service
+        self.execute = execute or (lambda request: request.execute())
+        self.root_folder_id = root_folder_id
+        self.index_path = index_path
+        self.files = {}
+        self.page_token = None
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Loads the persisted index if it belongs to the same root folder."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as index_file:
+                state = json.load(index_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable Drive index {self.index_path}: {e}")
+            return
+        if state.get('root_folder_id') != self.root_folder_id:
+            return
+        self.files = state.get('files', {})
+        self.page_token = state.get('page_token')
+
+    def save(self):
+        """Persists the index atomically."""
+        with self.lock:
+            state = {'root_folder_id': self.root_folder_id, 'page_token': self.page_token, 'files': self.files}
+        try:
+            write_atomic(self.index_path, json.dumps(state))
+        except OSError as e:
+            logging.warning(f"Could not save Drive index {self.index_path}: {e}")
+
+    def refresh(self):
+        """Brings the index up to date, rebuilding it on first use."""
+        with self.refresh_lock:
+            try:
+                if self.page_token is None:
+                    self.rebuild()
+                else:
+                    self._apply_changes()
+            except Exception as e:
+                handle_error("Error refreshing Drive index", e)
+                raise DriveFolderIndexError(f"Could not refresh Drive index: {e}") from e
+            self.save()
+
+    def rebuild(self):
+        """Lists the whole folder tree from scratch."""
+        logging.info(f"Building Drive index for folder: {self.root_folder_id}")
+        # Take the token first so changes made while listing are replayed on the next refresh
+        page_token = self.execute(self.drive_service.changes().getStartPageToken()).get('startPageToken')
+        files = {}
+        pending = [self.root_folder_id]
+        while pending:
+            folder_id = pending.pop()
+            for file in self._list_children(folder_id):
+                files[file['id']] = self._entry(file)
+                if file.get('mimeType') == FOLDER_MIME_TYPE:
+                    pending.append(file['id'])
+        with self.lock:
+            self.files = files
+            self.page_token = page_token
+        logging.info(f"Drive index built with {len(files)} entries")
+
+    def _list_children(self, folder_id):
+        """Yields every non-trashed child of a folder, following pagination."""
+        page_token = None
+        while True:
+            response = self.execute(self.drive_service.files().list(
+                q=f"'{folder_id}' in parents and trashed=false",
+                fields=f'nextPageToken, files({FILE_FIELDS})',
+                pageSize=1000,
+                pageToken=page_token,
+            ))
+            yield from response.get('files', [])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+
+    def _apply_changes(self):
+        """Replays the changes feed since the stored page token."""
+        changes = []
+        page_token = self.page_token
+        while page_token:
+            response = self.execute(self.drive_service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                pageSize=1000,
+                fields=f'nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))',
+            ))
+            changes.extend(response.get('changes', []))
+            if response.get('newStartPageToken'):
+                new_page_token = response['newStartPageToken']
+                break
+            page_token = response.get('nextPageToken')
+        else:
+            new_page_token = self.page_token
+
+        with self.lock:
+            # A file can be reported before the folder it was created in, so retry until nothing moves
+            while changes:
+                deferred = [change for change in changes if not self._apply_change(change)]
+                if len(deferred) == len(changes):
+                    for change in deferred:
+                        self._remove(change.get('fileId'))
+                    break
+                changes = deferred
+            self.page_token = new_page_token
+        logging.info(f"Drive index refreshed, {len(self.files)} entries")
+
+    def _apply_change(self, change):
+        """Applies one change; returns False when its parent is not known yet."""
+        file_id = change.get('fileId')
+        file = change.get('file') or {}
+        if change.get('removed') or file.get('trashed'):
+            self._remove(file_id)
+            return True
+        if not any(self.covers(parent) for parent in file.get('parents', [])):
+            if file_id in self.files:
+                self._remove(file_id)
+                return True
+            return False
+        is_new_folder = file_id not in self.files and file.get('mimeType') == FOLDER_MIME_TYPE
+        self.files[file_id] = self._entry(file)
+        if is_new_folder:
+            # A folder moved into the tree brings its content along without a change per child
+            for child in self._list_children(file_id):
+                self.files[child['id']] = self._entry(child)
+        return True
+
+    def _remove(self, file_id):
+        """Removes an entry and everything below it."""
+        self.files.pop(file_id, None)
+        children = [child_id for child_id, entry in self.files.items() if file_id in entry['parents']]
+        for child_id in children:
+            self._remove(child_id)
+
+    @staticmethod
+    def _entry(file):
+        return {'name': file.get('name'), 'mimeType': file.get('mimeType'), 'parents': file.get('parents', [])}
+
+    def covers(self, folder_id):
+        """Tells whether lookups under folder_id can be answered from the index."""
+        if folder_id == self.root_folder_id:
+            return True
+        entry = self.files.get(folder_id)
+        return entry is not None and entry['mimeType'] == FOLDER_MIME_TYPE
+
+    def find(self, name, parent_folder_id, mime_type=None):
+        """Returns the ID of the first entry with the given name under parent_folder_id."""
+        with self.lock:
+            for file_id, entry in self.files.items():
+                if (entry['name'] == name and parent_folder_id in entry['parents']
+                        and (mime_type is None or entry['mimeType'] == mime_type)):
+                    return file_id
+        return None
+
+    def record(self, file_id, name, mime_type, parents):
+        """Records a file created or moved by this app, or drops it if it left the tree."""
+        with self.lock:
+            if any(self.covers(parent) for parent in parents):
+                self.files[file_id] = {'name': name, 'mimeType': mime_type, 'parents': list(parents)}
+            else:
+                self._remove(file_id)
+        self.save()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_drive_index(drive_service, root_folder_id, index_path, execute=None):
+    """Returns the process-wide index stored at index_path, so concurrent users don't overwrite its file."""
+    key = os.path.abspath(index_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None or index.root_folder_id != root_folder_id or index.drive_service is not drive_service:
+            index = DriveFolderIndex(drive_service, root_folder_id, index_path, execute)
+            _indexes[key] = index
+        return index
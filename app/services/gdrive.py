@@ -1,28 +1,107 @@
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+import io
+import json
+import time
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
+from app.core.scheduler import error_status
+from app.core.tracing import add_to_span, payload_size, traced
 from app.core.utils import handle_error, logging
+from app.services.clients import get_client_factory
+from app.services.drive_batch import get_request_coalescer
+from app.services.drive_index import DriveFolderIndexError, FOLDER_MIME_TYPE, get_drive_index
+
+# Resumable upload chunks must be a multiple of 256 KB
+UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_UPLOAD_CHUNK_SIZE = 4 * UPLOAD_CHUNK_ALIGNMENT
+# Resumable uploads answer 308 for every chunk but the last
+RESUME_INCOMPLETE = 308
+
+FORM_MIME_TYPE = 'application/vnd.google-apps.form'
 
 class GoogleDriveHelperError(Exception):
     """Custom exception for GoogleDriveHelper errors."""
     pass
 
 class GoogleDriveHelper:
-    def __init__(self, credentials):
+    def __init__(self, credentials, client_factory=None, scheduler=None, upload_sessions=None,
+                 chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE):
         self.credentials = credentials
+        self.client_factory = client_factory or get_client_factory(credentials)
+        self.scheduler = scheduler
+        self.upload_sessions = upload_sessions
+        self.chunk_size = max(UPLOAD_CHUNK_ALIGNMENT, chunk_size // UPLOAD_CHUNK_ALIGNMENT * UPLOAD_CHUNK_ALIGNMENT)
         self.drive_service = self._get_drive_service()
+        self.index = None
+        self.coalescer = None
 
     def _get_drive_service(self):
-        """Builds and returns the Google Drive service."""
-        return build('drive', 'v3', credentials=self.credentials)
+        """Returns the shared Google Drive service."""
+        return self.client_factory.get('drive', 'v3')
+
+    def execute(self, request, idempotent=True, probe=None):
+        """Executes a Drive request under the shared quota and retry policy."""
+        add_to_span(bytes_sent=payload_size(getattr(request, 'body', None)))
+        if self.scheduler is None:
+            response = request.execute()
+        else:
+            response = self.scheduler.call('drive', request.execute, idempotent=idempotent, probe=probe)
+        add_to_span(bytes_received=payload_size(response))
+        return response
+
+    def enable_batching(self, window):
+        """Sends small metadata calls made within window seconds of each other as one batch request."""
+        self.coalescer = get_request_coalescer(self.drive_service, self.scheduler,
+                                               getattr(self.client_factory, 'http', None), window)
+
+    def execute_small(self, request):
+        """Executes a small request that is safe to repeat, batched with concurrent ones when enabled."""
+        if self.coalescer is None:
+            return self.execute(request)
+        add_to_span(bytes_sent=payload_size(getattr(request, 'body', None)))
+        response = self.coalescer.call(request)
+        add_to_span(bytes_received=payload_size(response))
+        return response
+
+    def _probe_created(self, name, parent_folder_id, mime_type):
+        """Looks up, bypassing the index, a file that a failed create may have produced."""
+        query = f"name='{name}' and mimeType='{mime_type}' and trashed=false"
+        if parent_folder_id:
+            query += f" and '{parent_folder_id}' in parents"
+        files = self.drive_service.files().list(q=query, fields='files(id)').execute().get('files')
+        return {'id': files[0]['id']} if files else None
+
+    @traced('drive')
+    def enable_index(self, root_folder_id, index_path):
+        """Answers name lookups under root_folder_id from the process-wide local index, refreshed first."""
+        index = get_drive_index(self.drive_service, root_folder_id, index_path, execute=self.execute)
+        try:
+            index.refresh()
+        except DriveFolderIndexError as e:
+            logging.warning(f"Drive index disabled for this run: {e}")
+            return None
+        self.index = index
+        return index
+
+    def _indexed(self, parent_folder_id):
+        return self.index is not None and parent_folder_id is not None and self.index.covers(parent_folder_id)
+
+    def _record(self, file_id, name, mime_type, parents):
+        if self.index is not None and file_id:
+            self.index.record(file_id, name, mime_type, parents)
 
+    @traced('drive')
     def get_folder_id(self, folder_name, parent_folder_id=None):
         """Retrieves the ID of a folder by its name."""
+        if self._indexed(parent_folder_id):
+            folder_id = self.index.find(folder_name, parent_folder_id, FOLDER_MIME_TYPE)
+            logging.info(f"Folder id from index: {folder_id}")
+            return folder_id
         try:
             query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
             if parent_folder_id:
                 query += f" and '{parent_folder_id}' in parents"
 
-            response = self.drive_service.files().list(q=query, fields='files(id, name)').execute()
+            response = self.execute_small(self.drive_service.files().list(q=query, fields='files(id, name)'))
             folder = response.get('files')
             if folder:
                 folder_id = folder[0].get('id')
@@ -35,6 +114,7 @@ class GoogleDriveHelper:
             handle_error(f"Error getting folder ID for '{folder_name}'", e)
             raise GoogleDriveHelperError(f"Could not get folder ID: {e}") from e
 
+    @traced('drive')
     def create_folder(self, folder_name, parent_folder_id=None):
         """Creates a new folder with the given name."""
         try:
@@ -45,22 +125,32 @@ class GoogleDriveHelper:
             if parent_folder_id:
                 file_metadata['parents'] = [parent_folder_id]
 
-            folder = self.drive_service.files().create(body=file_metadata, fields='id').execute()
+            folder = self.execute(
+                self.drive_service.files().create(body=file_metadata, fields='id'),
+                idempotent=False,
+                probe=lambda: self._probe_created(folder_name, parent_folder_id, FOLDER_MIME_TYPE),
+            )
             folder_id = folder.get('id')
+            self._record(folder_id, folder_name, FOLDER_MIME_TYPE, file_metadata.get('parents', []))
             logging.info(f"Folder created with id: {folder_id}")
             return folder_id
         except Exception as e:
             handle_error(f"Error creating folder '{folder_name}'", e)
             raise GoogleDriveHelperError(f"Could not create folder: {e}") from e
 
+    @traced('drive')
     def get_file_id(self, file_name, parent_folder_id=None):
         """Retrieves the ID of a file by its name."""
+        if self._indexed(parent_folder_id):
+            file_id = self.index.find(file_name, parent_folder_id)
+            logging.info(f"File id from index: {file_id}")
+            return file_id
         try:
             query = f"name='{file_name}' and trashed=false"
             if parent_folder_id:
                 query += f" and '{parent_folder_id}' in parents"
 
-            response = self.drive_service.files().list(q=query, fields='files(id, name)').execute()
+            response = self.execute_small(self.drive_service.files().list(q=query, fields='files(id, name)'))
             file = response.get('files')
             if file:
                 file_id = file[0].get('id')
@@ -73,12 +163,34 @@ class GoogleDriveHelper:
             handle_error(f"Error getting file ID for '{file_name}'", e)
             raise GoogleDriveHelperError(f"Could not get file ID: {e}") from e
 
-    def move_file(self, file_id, new_parent_folder_id, old_parent_folder_id, new_name=None):
-        """Moves a file to a new folder."""
+    @traced('drive')
+    def list_folder_files(self, folder_id, fields='id, name, md5Checksum, size'):
+        """Lists the files directly in a folder, following every page."""
+        try:
+            files = []
+            page_token = None
+            while True:
+                response = self.execute(self.drive_service.files().list(
+                    q=f"'{folder_id}' in parents and trashed=false",
+                    fields=f'nextPageToken, files({fields})',
+                    pageSize=1000,
+                    pageToken=page_token,
+                ))
+                files.extend(response.get('files', []))
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    return files
+        except Exception as e:
+            handle_error(f"Error listing folder '{folder_id}'", e)
+            raise GoogleDriveHelperError(f"Could not list folder: {e}") from e
+
+    @traced('drive')
+    def move_file(self, file_id, new_parent_folder_id, old_parent_folder_id=None, new_name=None):
+        """Moves a file to a new folder, out of all its current parents."""
         logging.info(f"Moving file: {file_id} to folder: {new_parent_folder_id}")
         try:
             # Retrieve the existing parents to remove
-            file = self.drive_service.files().get(fileId=file_id, fields='parents, name').execute()
+            file = self.execute_small(self.drive_service.files().get(fileId=file_id, fields='parents, name'))
             previous_parents = ",".join(file.get('parents'))
 
             # File's new metadata.
@@ -87,13 +199,14 @@ class GoogleDriveHelper:
                 file_metadata['name'] = new_name
 
             # Move the file to the new folder
-            file = self.drive_service.files().update(
+            file = self.execute(self.drive_service.files().update(
                 fileId=file_id,
                 body=file_metadata,
                 addParents=new_parent_folder_id,
                 removeParents=previous_parents,
-                fields='id, parents'
-            ).execute()
+                fields='id, name, mimeType, parents'
+            ))
+            self._record(file.get('id'), file.get('name'), file.get('mimeType'), file.get('parents', []))
 
             logging.info(f"File moved with id: {file.get('id')}")
             return file.get('id')
@@ -101,11 +214,30 @@ class GoogleDriveHelper:
             handle_error(f"Error moving file '{file_id}'", e)
             raise GoogleDriveHelperError(f"Could not move file: {e}") from e
 
+    @traced('drive')
+    def copy_file(self, file_id, new_name, parent_folder_id, mime_type=FORM_MIME_TYPE):
+        """Copies a file, e.g. a template form, into a folder under a new name."""
+        logging.info(f"Copying file: {file_id} to folder: {parent_folder_id} as {new_name}")
+        try:
+            file = self.execute(
+                self.drive_service.files().copy(fileId=file_id, body={'name': new_name, 'parents': [parent_folder_id]},
+                                                fields='id'),
+                idempotent=False,
+                probe=lambda: self._probe_created(new_name, parent_folder_id, mime_type),
+            )
+            self._record(file.get('id'), new_name, mime_type, [parent_folder_id])
+            logging.info(f"File copied with id: {file.get('id')}")
+            return file.get('id')
+        except Exception as e:
+            handle_error(f"Error copying file '{file_id}'", e)
+            raise GoogleDriveHelperError(f"Could not copy file: {e}") from e
+
+    @traced('drive')
     def get_form_webViewLink(self, form_id):
         """Retrieves the webViewLink of a form by its ID."""
         logging.info(f"Getting webViewLink for form: {form_id}")
         try:
-            file = self.drive_service.files().get(fileId=form_id, fields='webViewLink').execute()
+            file = self.execute_small(self.drive_service.files().get(fileId=form_id, fields='webViewLink'))
             webViewLink = file.get('webViewLink')
             logging.info(f"webViewLink: {webViewLink}")
             return webViewLink
@@ -113,11 +245,24 @@ class GoogleDriveHelper:
             handle_error(f"Error getting webViewLink for form '{form_id}'", e)
             raise GoogleDriveHelperError(f"Could not get webViewLink: {e}") from e
 
+    @traced('drive')
+    def folder_exists(self, folder_id):
+        """Tells whether a folder can still be read and is not in the trash."""
+        try:
+            file = self.execute_small(self.drive_service.files().get(fileId=folder_id, fields='id, trashed'))
+            return not file.get('trashed')
+        except Exception as e:
+            if error_status(e) == 404:
+                return False
+            handle_error(f"Error checking folder '{folder_id}'", e)
+            raise GoogleDriveHelperError(f"Could not check folder: {e}") from e
+
+    @traced('drive')
     def get_root_folder_id(self):
         """Retrieves the ID of the root folder."""
         logging.info("Getting root folder id")
         try:
-            file = self.drive_service.files().get(fileId='root').execute()
+            file = self.execute_small(self.drive_service.files().get(fileId='root'))
             root_folder_id = file.get('id')
             logging.info(f"Root folder id: {root_folder_id}")
             return root_folder_id
@@ -125,17 +270,138 @@ class GoogleDriveHelper:
             handle_error(f"Error getting root folder ID", e)
             raise GoogleDriveHelperError(f"Could not get root folder ID: {e}") from e
 
-    def upload_file(self, file, file_name, parent_folder_id, mime_type):
-        """Uploads a file to Google Drive."""
+    @traced('drive')
+    def upload_file(self, file, file_name, parent_folder_id, mime_type, progress_callback=None, file_id=None):
+        """Uploads a file to Google Drive in resumable chunks.
+
+        progress_callback(bytes_sent, total_bytes) is called after every chunk. When an
+        upload session store is configured, an interrupted upload resumes from the last
+        chunk the server acknowledged, even in a later run. With file_id, the content of
+        that existing file is replaced instead of creating a new one.
+        """
         logging.info(f"Uploading file: {file_name} to folder: {parent_folder_id}")
         try:
-            file_metadata = {'name': file_name, 'parents': [parent_folder_id]}
-            media = MediaFileUpload(file, mimetype=mime_type, resumable=True)
-            file = self.drive_service.files().create(body=file_metadata,
-                                                    media_body=media,
-                                                    fields='id').execute()
-            logging.info(f"File uploaded with id: {file.get('id')}")
-            return file.get('id')
+            session_key = None
+            if self.upload_sessions is not None:
+                # Replacing a file is a different session from creating one in the same folder
+                target = f"{parent_folder_id}/{file_id}" if file_id else parent_folder_id
+                session_key = self.upload_sessions.key_for(file, file_name, target)
+            try:
+                uploaded = self._upload_in_chunks(file, file_name, parent_folder_id, mime_type,
+                                                  session_key, progress_callback, file_id)
+            except HttpError as e:
+                # The saved session expired or was discarded by the server: start over once
+                if session_key is None or e.resp.status not in (404, 410):
+                    raise
+                logging.warning(f"Upload session for {file_name} expired, restarting upload")
+                self.upload_sessions.remove(session_key)
+                uploaded = self._upload_in_chunks(file, file_name, parent_folder_id, mime_type,
+                                                  session_key, progress_callback, file_id)
+            if session_key is not None:
+                self.upload_sessions.remove(session_key)
+            self._record(uploaded.get('id'), file_name, mime_type, [parent_folder_id])
+            logging.info(f"File uploaded with id: {uploaded.get('id')}")
+            return uploaded.get('id')
         except Exception as e:
             handle_error(f"Error uploading file '{file_name}'", e)
             raise GoogleDriveHelperError(f"Could not upload file: {e}") from e
+
+    def _upload_in_chunks(self, file, file_name, parent_folder_id, mime_type, session_key, progress_callback,
+                          file_id=None):
+        media = MediaFileUpload(file, mimetype=mime_type, chunksize=self.chunk_size, resumable=True)
+        if file_id:
+            request = self.drive_service.files().update(fileId=file_id, media_body=media, fields='id')
+        else:
+            file_metadata = {'name': file_name, 'parents': [parent_folder_id]}
+            request = self.drive_service.files().create(body=file_metadata, media_body=media, fields='id')
+        saved_uri = self.upload_sessions.get(session_key) if session_key is not None else None
+        response = None
+        if saved_uri:
+            logging.info(f"Resuming upload of {file_name}")
+            request.resumable_uri = saved_uri
+            request.resumable_progress, response = self._query_upload(saved_uri, media.size())
+
+        while response is None:
+            # Each chunk carries its byte range, so re-sending one is safe
+            status, response = self.execute_chunk(request)
+            if session_key is not None and request.resumable_uri and response is None:
+                self.upload_sessions.save(session_key, request.resumable_uri)
+            if status is not None and progress_callback:
+                progress_callback(status.resumable_progress, status.total_size)
+        if progress_callback:
+            progress_callback(media.size(), media.size())
+        return response
+
+    def _query_upload(self, session_uri, total):
+        """Asks an upload session how many bytes the server kept; returns (offset, file or None).
+
+        Raises HttpError when the session is gone (404, 410), so the caller starts over.
+        """
+        http = self.client_factory.http()
+
+        def query():
+            resp, content = http.request(session_uri, method='PUT', body=b'',
+                                         headers={'Content-Range': f'bytes */{total}', 'Content-Length': '0'})
+            if resp.status >= 400:
+                raise HttpError(resp, content, uri=session_uri)
+            return resp, content
+
+        resp, content = query() if self.scheduler is None else self.scheduler.call('drive', query)
+        if resp.status == RESUME_INCOMPLETE:
+            received = resp.get('range')
+            return (int(received.rsplit('-', 1)[1]) + 1 if received else 0), None
+        # The earlier run sent every byte but never saw the answer
+        return total, json.loads(content) if content else {}
+
+    def execute_chunk(self, request):
+        """Sends the next chunk of a resumable upload under the shared quota and retry policy."""
+        sent_before = request.resumable_progress
+        if self.scheduler is None:
+            status, response = request.next_chunk()
+        else:
+            status, response = self.scheduler.call('drive', request.next_chunk)
+        sent = status.resumable_progress if status is not None else request.resumable.size()
+        add_to_span(bytes_sent=sent - sent_before, bytes_received=payload_size(response))
+        return status, response
+
+    @traced('drive')
+    def save_text_file(self, file_name, content, parent_folder_id, mime_type='application/json'):
+        """Creates a small text file in a folder, or replaces the content of the existing one."""
+        logging.info(f"Saving file: {file_name} to folder: {parent_folder_id}")
+        try:
+            media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')), mimetype=mime_type)
+            file_id = self.get_file_id(file_name, parent_folder_id)
+            if file_id:
+                self.execute(self.drive_service.files().update(fileId=file_id, media_body=media, fields='id'))
+                return file_id
+            file = self.execute(
+                self.drive_service.files().create(body={'name': file_name, 'parents': [parent_folder_id]},
+                                                  media_body=media, fields='id'),
+                idempotent=False,
+            )
+            self._record(file.get('id'), file_name, mime_type, [parent_folder_id])
+            return file.get('id')
+        except Exception as e:
+            handle_error(f"Error saving file '{file_name}'", e)
+            raise GoogleDriveHelperError(f"Could not save file: {e}") from e
+
+    @traced('drive')
+    def wait_for_file_ready(self, file_id, timeout=30, interval=0.5):
+        """Waits until Drive reports the content of an uploaded file as stored."""
+        logging.info(f"Waiting for file to be ready: {file_id}")
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                file = self.execute_small(self.drive_service.files().get(fileId=file_id, fields='id, size'))
+                if file.get('size'):
+                    logging.info(f"File ready: {file_id} ({file.get('size')} bytes)")
+                    return True
+                if time.monotonic() + interval > deadline:
+                    raise GoogleDriveHelperError(f"File {file_id} not ready after {timeout}s")
+                time.sleep(interval)
+                interval = min(interval * 2, 5)
+        except GoogleDriveHelperError:
+            raise
+        except Exception as e:
+            handle_error(f"Error checking readiness of file '{file_id}'", e)
+            raise GoogleDriveHelperError(f"Could not check file readiness: {e}") from e
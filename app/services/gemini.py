@@ -1,17 +1,46 @@
+import io
+import json
 import google.generativeai as genai
+from googleapiclient.http import MediaIoBaseDownload
+from app.core.jsonstream import JsonArrayStreamParser
+from app.core.tracing import add_to_span, traced
 from app.core.utils import handle_error, logging
 
 class GoogleGeminiHelperError(Exception):
     """Custom exception for GoogleGeminiHelper errors."""
     pass
 
+# Images are downloaded from Drive in requests of at most this many bytes
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+MENU_PROMPT = "Analyze the menu in the image and extract the dishes and their allergens in JSON format."
+
+WEEK_PROMPT = (
+    "Each image below is the menu of the day named right before it. "
+    "Analyze every image as described and return a single JSON object whose keys are exactly "
+    "those day names and whose values are the JSON arrays of dishes extracted from that day's image."
+)
+
+def read_image(file_path):
+    """Reads a local image once; the bytes are handed to Gemini as they are, without another copy."""
+    with open(file_path, 'rb') as image_file:
+        return image_file.read()
+
+def is_valid_menu(menu):
+    """Checks that a parsed menu is a non-empty list of dishes with a name."""
+    return isinstance(menu, list) and bool(menu) and all(
+        isinstance(item, dict) and isinstance(item.get('name'), str) for item in menu
+    )
+
 class GoogleGeminiHelper:
-    def __init__(self, api_key, model_name, prompt, drive_service):
+    def __init__(self, api_key, model_name, prompt, drive_service, cache=None, scheduler=None):
         self.api_key = api_key
         self.model_name = model_name
         self.prompt = prompt
         self.model = self._configure_model()
         self.drive_service = drive_service
+        self.cache = cache
+        self.scheduler = scheduler
 
     def _configure_model(self):
         """Configures and returns the Gemini model."""
@@ -43,6 +72,22 @@ class GoogleGeminiHelper:
         )
         return model
 
+    def _generate_content(self, contents, stream=False):
+        """Calls the model under the shared quota and retry policy."""
+        add_to_span(bytes_sent=sum(len(part['data']) for part in contents if isinstance(part, dict)))
+        if self.scheduler is None:
+            return self.model.generate_content(contents, stream=stream)
+        return self.scheduler.call('gemini', self.model.generate_content, contents, stream=stream,
+                                   request_options={'timeout': self.scheduler.deadline})
+
+    @staticmethod
+    def _record_usage(response):
+        """Adds the token counts from the response metadata to the current span."""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            add_to_span(prompt_tokens=getattr(usage, 'prompt_token_count', 0),
+                        output_tokens=getattr(usage, 'candidates_token_count', 0))
+
     def _load_image_from_drive(self, file_id):
         """Loads image data from Google Drive using its file ID."""
         if not self.drive_service:
@@ -50,12 +95,22 @@ class GoogleGeminiHelper:
             raise GoogleGeminiHelperError("Drive service not initialized.")
         try:
             request = self.drive_service.files().get_media(fileId=file_id)
-            response = request.execute()
-            return response
+            # Fixed-size ranged requests, so no single response body holds the whole image
+            buffer = io.BytesIO()
+            downloader = MediaIoBaseDownload(buffer, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+            done = False
+            while not done:
+                if self.scheduler is None:
+                    _, done = downloader.next_chunk()
+                else:
+                    _, done = self.scheduler.call('drive', downloader.next_chunk)
+            add_to_span(bytes_received=buffer.tell())
+            return buffer.getvalue()
         except Exception as e:
             handle_error(f"Error loading image from Google Drive: {e}")
             raise GoogleGeminiHelperError(f"Could not load image from Drive: {e}") from e
 
+    @traced('gemini')
     def get_menu_json_from_drive_id(self, file_id):
         """Generates a menu JSON string for the given Google Drive file ID."""
         if self.model is None:
@@ -63,26 +118,191 @@ class GoogleGeminiHelper:
             raise GoogleGeminiHelperError("Gemini model not configured.")
 
         image_data = self._load_image_from_drive(file_id)
-        if image_data:
-            image_part = {"mime_type": "image/jpeg", "data": image_data}
+        if not image_data:
+            handle_error("Could not load the image from Google Drive.")
+            raise GoogleGeminiHelperError("Could not load the image from Google Drive.")
+        return self.get_menu_json_from_bytes(image_data)
+
+    def get_menu_json_from_file(self, file_path, on_item=None):
+        """Generates a menu JSON string for a local image file."""
+        try:
+            image_data = read_image(file_path)
+        except OSError as e:
+            handle_error(f"Error reading image file '{file_path}': {e}")
+            raise GoogleGeminiHelperError(f"Could not read image file: {e}") from e
+        return self.get_menu_json_from_bytes(image_data, on_item=on_item)
+
+    @traced('gemini')
+    def get_menu_json_from_bytes(self, image_data, mime_type="image/jpeg", on_item=None):
+        """Generates a menu JSON string for an in-memory image.
+
+        With on_item, the response is streamed and on_item(dish) is called for every dish as
+        soon as it is parsed; otherwise the full response is awaited.
+        """
+        if on_item is not None:
+            menu = []
+            for item in self.stream_menu_items_from_bytes(image_data, mime_type):
+                on_item(item)
+                menu.append(item)
+            return json.dumps(menu)
 
-            text_prompt = "Analyze the menu in the image and extract the dishes and their allergens in JSON format."
+        if self.model is None:
+            handle_error("Gemini model not configured.")
+            raise GoogleGeminiHelperError("Gemini model not configured.")
+        if not image_data:
+            handle_error("Empty image data.")
+            raise GoogleGeminiHelperError("Empty image data.")
+
+        cached = self._cached_menu(image_data)
+        if cached is not None:
+            return cached
+
+        image_part = {"mime_type": mime_type, "data": image_data}
+
+        try:
+            response = self._generate_content([MENU_PROMPT, image_part])
+            self._record_usage(response)
 
+            if response.prompt_feedback:
+                logging.warning(f"Prompt feedback: {response.prompt_feedback}")
+
+            if not response.candidates:
+                handle_error("No candidates returned in the response.")
+                raise GoogleGeminiHelperError("No candidates returned in the response.")
+
+            menu_json = response.candidates[0].content.parts[0].text
+            self._cache_menu(image_data, menu_json)
+            return menu_json
+
+        except GoogleGeminiHelperError:
+            raise
+        except Exception as e:
+            handle_error(f"An error occurred during the message sending: {e}")
+            raise GoogleGeminiHelperError(f"Error during message sending: {e}") from e
+
+    def _cached_menu(self, image_data):
+        """Returns the cached menu JSON of an image; entries that aren't a valid menu are misses."""
+        if not self.cache:
+            return None
+        cached = self.cache.get(image_data)
+        if cached is None:
+            return None
+        try:
+            menu = json.loads(cached)
+        except ValueError:
+            menu = None
+        if not is_valid_menu(menu):
+            logging.warning("Ignoring menu cache entry that is not a list of dishes")
+            return None
+        return cached
+
+    def _cache_menu(self, image_data, menu_json):
+        """Caches a menu JSON string, but only a valid menu, so a bad answer isn't replayed for weeks."""
+        if not self.cache:
+            return
+        try:
+            menu = json.loads(menu_json)
+        except (TypeError, ValueError):
+            menu = None
+        if not is_valid_menu(menu):
+            logging.warning("Not caching menu: response is not a list of dishes")
+            return
+        self.cache.put(image_data, menu_json)
+
+    def stream_menu_items_from_bytes(self, image_data, mime_type="image/jpeg"):
+        """Yields the dishes of an in-memory image while the model is still generating the rest."""
+        if self.model is None:
+            handle_error("Gemini model not configured.")
+            raise GoogleGeminiHelperError("Gemini model not configured.")
+        if not image_data:
+            handle_error("Empty image data.")
+            raise GoogleGeminiHelperError("Empty image data.")
+
+        cached = self._cached_menu(image_data)
+        if cached is not None:
+            yield from json.loads(cached)
+            return
+
+        parser = JsonArrayStreamParser()
+        chunks = []
+        try:
+            response = self._generate_content([MENU_PROMPT, {"mime_type": mime_type, "data": image_data}],
+                                              stream=True)
+            chunk = None
+            for chunk in response:
+                chunks.append(chunk.text)
+                yield from parser.feed(chunk.text)
+            # The last chunk carries the token counts of the whole response
+            self._record_usage(chunk)
+        except Exception as e:
+            handle_error(f"An error occurred while streaming the response: {e}")
+            raise GoogleGeminiHelperError(f"Error while streaming the response: {e}") from e
+
+        if not parser.done:
+            handle_error("Streamed response is not a complete JSON array.")
+            raise GoogleGeminiHelperError("Streamed response is not a complete JSON array.")
+        self._cache_menu(image_data, "".join(chunks))
+
+    def get_week_menu_json_from_files(self, file_paths):
+        """Generates menu JSON strings for a dict of day -> local image path in one request."""
+        images = {}
+        for day, file_path in file_paths.items():
             try:
-                response = self.model.generate_content([text_prompt, image_part])
+                images[day] = read_image(file_path)
+            except OSError as e:
+                handle_error(f"Error reading image file '{file_path}': {e}")
+        return self.get_week_menu_json(images)
 
-                if response.prompt_feedback:
-                    logging.warning(f"Prompt feedback: {response.prompt_feedback}")
+    @traced('gemini')
+    def get_week_menu_json(self, images, mime_type="image/jpeg"):
+        """Generates menu JSON strings for a dict of day -> image bytes in one request.
 
-                if not response.candidates:
-                    handle_error("No candidates returned in the response.")
-                    raise GoogleGeminiHelperError("No candidates returned in the response.")
+        Only the days whose menu was found in the cache or passed validation are returned;
+        callers fall back to get_menu_json_from_bytes for the others.
+        """
+        if self.model is None:
+            handle_error("Gemini model not configured.")
+            raise GoogleGeminiHelperError("Gemini model not configured.")
 
-                return response.candidates[0].content.parts[0].text
+        menus = {}
+        missing = {}
+        for day, image_data in images.items():
+            cached = self._cached_menu(image_data)
+            if cached is not None:
+                menus[day] = cached
+            elif image_data:
+                missing[day] = image_data
+        if not missing:
+            return menus
 
-            except Exception as e:
-                handle_error(f"An error occurred during the message sending: {e}")
-                raise GoogleGeminiHelperError(f"Error during message sending: {e}") from e
-        else:
-            handle_error("Could not load the image from Google Drive.")
-            raise GoogleGeminiHelperError("Could not load the image from Google Drive.")
+        contents = [WEEK_PROMPT]
+        for day, image_data in missing.items():
+            contents.append(f"{day}:")
+            contents.append({"mime_type": mime_type, "data": image_data})
+
+        try:
+            response = self._generate_content(contents)
+            self._record_usage(response)
+            if response.prompt_feedback:
+                logging.warning(f"Prompt feedback: {response.prompt_feedback}")
+            if not response.candidates:
+                logging.warning("No candidates returned for the week request.")
+                return menus
+            week_menus = json.loads(response.candidates[0].content.parts[0].text)
+        except Exception as e:
+            logging.warning(f"Week request failed, falling back to one request per day: {e}")
+            return menus
+
+        if not isinstance(week_menus, dict):
+            logging.warning("Week response is not a JSON object, falling back to one request per day.")
+            return menus
+
+        for day, image_data in missing.items():
+            menu = week_menus.get(day)
+            if not is_valid_menu(menu):
+                logging.warning(f"Week response has no valid menu for {day}.")
+                continue
+            menu_json = json.dumps(menu)
+            self._cache_menu(image_data, menu_json)
+            menus[day] = menu_json
+        return menus
@@ -1,25 +1,43 @@
-from googleapiclient.discovery import build
+import json
+from app.core.tracing import add_to_span, payload_size, traced
 from app.core.utils import handle_error, logging
+from app.services.clients import get_client_factory
 
 class GoogleFormsHelperError(Exception):
     """Custom exception for GoogleFormsHelper errors."""
     pass
 
+# Keep each batchUpdate body well below the API request size limit
+MAX_BATCH_UPDATE_BYTES = 512 * 1024
+
 class GoogleFormsHelper:
-    def __init__(self, credentials):
+    def __init__(self, credentials, client_factory=None, scheduler=None):
         self.credentials = credentials
+        self.client_factory = client_factory or get_client_factory(credentials)
+        self.scheduler = scheduler
         self.service = self._get_forms_service()
 
     def _get_forms_service(self):
-        """Builds and returns the Google Forms service."""
-        return build('forms', 'v1', credentials=self.credentials)
+        """Returns the shared Google Forms service."""
+        return self.client_factory.get('forms', 'v1')
+
+    def execute(self, request, idempotent=True):
+        """Executes a Forms request under the shared quota and retry policy."""
+        add_to_span(bytes_sent=payload_size(getattr(request, 'body', None)))
+        if self.scheduler is None:
+            response = request.execute()
+        else:
+            response = self.scheduler.call('forms', request.execute, idempotent=idempotent)
+        add_to_span(bytes_received=payload_size(response))
+        return response
 
+    @traced('forms')
     def create_form(self, title):
         """Creates a new Google Form with the given title."""
         try:
-            form = self.service.forms().create(
+            form = self.execute(self.service.forms().create(
                 body={'info': {'title': title}}
-            ).execute()
+            ), idempotent=False)
             form_id = form.get('formId')
             logging.info(f"{form_id}: Form created")
             return form
@@ -27,23 +45,46 @@ class GoogleFormsHelper:
             handle_error(f"Error creating form with title '{title}'", e)
             raise GoogleFormsHelperError(f"Could not create form: {e}") from e
 
+    @traced('forms')
     def get_form(self, form_id):
         """Retrieves a Google Form by its ID."""
         try:
-            form = self.service.forms().get(formId=form_id).execute()
+            form = self.execute(self.service.forms().get(formId=form_id))
             return form
         except Exception as e:
             handle_error(f"Error getting form with ID {form_id}", e)
             raise GoogleFormsHelperError(f"Could not get form: {e}") from e
 
-    def update_form(self, form_id, requests):
-        """Updates a Google Form with the given requests."""
+    @traced('forms')
+    def update_form(self, form_id, requests, max_body_bytes=MAX_BATCH_UPDATE_BYTES):
+        """Updates a Google Form with the given requests, in as few batchUpdate calls as fit the size limit."""
         try:
-            form = self.service.forms().batchUpdate(
-                formId=form_id, body={'requests': requests}
-            ).execute()
+            replies = []
+            form = None
+            for chunk in self._chunk_requests(requests, max_body_bytes):
+                # createItem is not idempotent, so this is only retried when the quota rejected it
+                form = self.execute(self.service.forms().batchUpdate(
+                    formId=form_id, body={'requests': chunk}
+                ), idempotent=False)
+                replies.extend(form.get('replies', []))
             logging.info(f"{form_id}: Form updated")
+            if form is not None:
+                form['replies'] = replies
             return form
         except Exception as e:
             handle_error(f"Error updating form with ID {form_id}", e)
             raise GoogleFormsHelperError(f"Could not update form: {e}") from e
+
+    @staticmethod
+    def _chunk_requests(requests, max_body_bytes):
+        """Splits requests into ordered chunks whose serialized size stays under max_body_bytes."""
+        chunk, chunk_bytes = [], 0
+        for request in requests:
+            request_bytes = len(json.dumps(request)) + 1
+            if chunk and chunk_bytes + request_bytes > max_body_bytes:
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(request)
+            chunk_bytes += request_bytes
+        if chunk:
+            yield chunk
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import threading
+from app.core.utils import file_digest, logging, write_atomic
+
+class UploadSessionStore:
+    """Persists resumable upload session URIs so an interrupted upload can continue in a later run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key_for(file_path, file_name, parent_folder_id):
+        """Identifies an upload by file content and destination, not by its (temporary) path."""
+        content_hash = file_digest(file_path, 'sha256')
+        return hashlib.sha256(f"{content_hash}:{parent_folder_id}:{file_name}".encode('utf-8')).hexdigest()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as sessions_file:
+                return json.load(sessions_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable upload sessions {self.path}: {e}")
+            return {}
+
+    def _write(self, sessions):
+        try:
+            write_atomic(self.path, json.dumps(sessions))
+        except OSError as e:
+            logging.warning(f"Could not save upload sessions {self.path}: {e}")
+
+    def get(self, key):
+        """Returns the session URI saved for an upload, if any."""
+        with self.lock:
+            return self._read().get(key)
+
+    def save(self, key, session_uri):
+        """Saves the session URI of an upload in progress."""
+        with self.lock:
+            sessions = self._read()
+            if sessions.get(key) != session_uri:
+                sessions[key] = session_uri
+                self._write(sessions)
+
+    def remove(self, key):
+        """Forgets an upload once it completed or its session expired."""
+        with self.lock:
+            sessions = self._read()
+            if sessions.pop(key, None) is not None:
+                self._write(sessions)
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime
+from app.core.imaging import preprocess_images
+from app.core.utils import is_valid_jpeg, logging
+from app.script_runner import ScriptRunner, ScriptRunnerError
+from app.services.drive_index import DriveFolderIndexError
+from app.services.gdrive import GoogleDriveHelperError
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# Day names and abbreviations recognized in file names, e.g. "mon.jpg" or "Week42_Tuesday.jpeg"
+DAY_PATTERNS = {
+    'Monday': r'mon(day)?',
+    'Tuesday': r'tue(s|sday)?',
+    'Wednesday': r'wed(nesday)?',
+    'Thursday': r'thu(r|rs|rsday)?',
+    'Friday': r'fri(day)?',
+}
+WEEK_PATTERN = re.compile(r'(?<![a-z])(?:week|wk|kw|w)[\s_-]?(\d{1,2})(?!\d)')
+
+def parse_image_name(path, days):
+    """Returns (day, week) from a file name; either is None when the name doesn't say.
+
+    A day is a day name or its abbreviation, or the whole name is its position in the
+    week ("1.jpeg" is Monday, as in the week folder). A week is written like "week42",
+    "w42" or "kw42".
+    """
+    stem = os.path.splitext(os.path.basename(path))[0].lower()
+    week_match = WEEK_PATTERN.search(stem)
+    week = int(week_match.group(1)) if week_match and 1 <= int(week_match.group(1)) <= 53 else None
+    if stem.isdigit() and 1 <= int(stem) <= len(days):
+        return days[int(stem) - 1], week
+    found = [day for day in days
+             if re.search(rf'(?<![a-z]){DAY_PATTERNS[day]}(?![a-z])', stem)]
+    return (found[0] if len(found) == 1 else None), week
+
+class FolderWatcher:
+    """Polls a directory for JPEG files by modification time and size.
+
+    Each poll is a single directory scan. A file is reported once its mtime and size
+    are unchanged between two polls, so a file still being copied waits for the next one.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.last_seen = {}
+        self.reported = {}
+
+    def poll(self):
+        """Returns the paths that are new or changed and settled since the last poll."""
+        current = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.lower().endswith(JPEG_EXTENSIONS) or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    current[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            logging.warning(f"Could not scan {self.directory}: {e}")
+            return []
+        settled = sorted(path for path, signature in current.items()
+                         if self.last_seen.get(path) == signature and self.reported.get(path) != signature)
+        self.last_seen = current
+        self.reported = {path: signature for path, signature in self.reported.items() if path in current}
+        for path in settled:
+            self.reported[path] = current[path]
+        return settled
+
+class MenuPrefetcher(ScriptRunner):
+    """Prepares day images dropped in a folder before the run that builds the form.
+
+    Each image is preprocessed, uploaded to the week folder under its day file name and
+    sent to Gemini, whose answer lands in the menu cache. A later run finds the identical
+    upload through upload dedup and the menu in the cache, so it only builds the form.
+    Nothing goes into the run journal, so choosing other images later is still safe.
+    """
+
+    def __init__(self, config, ui_handler, credentials=None, client_factory=None):
+        super().__init__(config, credentials, client_factory)
+        self.ui_handler = ui_handler
+        self.folder_lock = None
+
+    async def week_folder(self, week_number):
+        """Returns the ID of a week folder, creating it once even when days arrive together.
+
+        The folder is looked up again for every image, with the Drive index refreshed
+        first: a run or another device may have created it since, or it may be gone.
+        """
+        async with self.folder_lock:
+            if self.drive_helper.index is not None:
+                try:
+                    await self.run_blocking(self.drive_helper.index.refresh)
+                except DriveFolderIndexError as e:
+                    raise ScriptRunnerError(f"Could not look up the week folder: {e}") from e
+            name = str(week_number)
+            folder_id = await self.drive_call('get_folder_id', name, self.project_folder_id)
+            if not folder_id:
+                folder_id = await self.drive_call('create_folder', name, self.project_folder_id)
+                self.ui_handler.log_message(f"Week folder created with id: {folder_id}")
+            return folder_id
+
+    async def prefetch(self, day, path, week_number):
+        """Uploads and extracts one day image; failures are logged, the next change retries."""
+        self.ui_handler.log_message(f"Preparing {day} of week {week_number} from {os.path.basename(path)}")
+        if not is_valid_jpeg(path):
+            self.ui_handler.log_message(f"Skipping {path}: not a JPEG image", error=True)
+            return
+        # Not self.preprocess_dir: several days are prepared at the same time
+        work_dir = tempfile.mkdtemp(prefix="flolunchmenu-watch-")
+        image_path = path
+        try:
+            if self.config.IMAGE_PREPROCESS_ENABLED:
+                # Same settings as the run, so it produces the same bytes and hits the same cache entry
+                results = await self.run_blocking(preprocess_images, {day: path}, work_dir,
+                                                  self.config.IMAGE_MAX_DIMENSION, self.config.IMAGE_JPEG_QUALITY)
+                image_path = results[day][0]
+            folder_id = await self.week_folder(week_number)
+            await asyncio.gather(self.prefetch_upload(day, image_path, folder_id),
+                                 self.async_get_menu_json(image_path))
+            self.ui_handler.log_message(f"{day} of week {week_number} is ready")
+        except (ScriptRunnerError, GoogleDriveHelperError) as e:
+            self.ui_handler.log_message(f"Could not prepare {day}: {e}", error=True)
+        finally:
+            # The same path holds a different image when the file changes again
+            self.image_digests.pop(image_path, None)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def prefetch_upload(self, day, image_path, folder_id):
+        file_name = self.image_file_name(day)
+        matches = await self.find_uploaded_images({day: image_path}, {day: file_name}, folder_id)
+        existing_id, unchanged = matches.get(day, (None, False))
+        if unchanged:
+            return existing_id
+        file_id = await self.async_upload_file(image_path, file_name, folder_id, 'image/jpeg', None, existing_id)
+        await self.async_wait_for_file(file_id)
+        return file_id
+
+    async def watch(self, directory, week_number=None, interval=5.0, project_folder_id=None, on_image=None):
+        """Polls directory until cancelled and prepares every day image that settles in it.
+
+        Files without a week in their name belong to week_number, by default the current
+        week. on_image(day, path, week) is called for each image before it is prepared.
+        A newer image for the same day cancels the preparation of the older one.
+        """
+        self.folder_lock = asyncio.Lock()
+        self.project_folder_id = project_folder_id or self.config.GOOGLE_DRIVE_PROJECT_FOLDER_ID
+        watcher = FolderWatcher(directory)
+        tasks = {}
+        self.ui_handler.log_message(f"Watching {directory} for menu images")
+        try:
+            await self.initialize_helpers()
+            while True:
+                for path in watcher.poll():
+                    day, week = parse_image_name(path, self.days)
+                    if day is None:
+                        logging.info(f"Watch: no day in the name of {path}, ignoring it")
+                        continue
+                    week = week or week_number or datetime.now().isocalendar()[1]
+                    if on_image:
+                        on_image(day, path, week)
+                    previous = tasks.get((week, day))
+                    if previous is not None and not previous.done():
+                        previous.cancel()
+                    tasks[(week, day)] = asyncio.ensure_future(self.prefetch(day, path, week))
+                await asyncio.sleep(interval)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            await self.close_async_http()
@@ -0,0 +1,192 @@
+"""End-to-end benchmark of a full weekly run against in-process fake Google services.
+
+Runs ScriptRunner on five generated menu images with Drive, Forms and Gemini replaced
+by the fakes in benchmarks/fakes.py, then reports wall time, per-stage timings and
+API calls and bytes and the peak resident memory. With --baseline, exits with status 1 when the wall time or the
+number of calls regresses by more than the threshold.
+
+    python benchmarks/e2e.py --save-baseline benchmarks/e2e_baseline.json
+    python benchmarks/e2e.py --baseline benchmarks/e2e_baseline.json --threshold 0.2
+    python benchmarks/e2e.py --drive-latency 0.2 --error-rate 0.05 --gemini-quota 10
+    python benchmarks/e2e.py --template
+    python benchmarks/e2e.py --async-http
+
+--async-http sends the Drive and Forms calls through the httpx client (pip install httpx)
+to the same fakes over an httpx.MockTransport. The response to the first upload chunk is
+lost, so the resumable upload has to query its offset before it continues.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.fakes import ApiProfile, FakeBackend, FakeClientFactory, FakeCredentials, FakeGenerativeModel
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+
+class QuietHandler:
+    """UI stand-in that keeps the log in memory."""
+
+    def __init__(self):
+        self.messages = []
+
+    def log_message(self, message, error=False):
+        self.messages.append(("ERROR: " if error else "") + message)
+
+    def update_progress(self, value):
+        pass
+
+    def enable_buttons(self):
+        pass
+
+def configure_environment(work_dir, args):
+    """Points every on-disk store at work_dir so runs never share state."""
+    os.environ.update({
+        'GEMINI_API_KEY': 'benchmark',
+        'GOOGLE_DRIVE_PROJECT_FOLDER_ID': 'root-folder',
+        'GOOGLE_OAUTH2_FILE': os.path.join(work_dir, 'oauth.json'),
+        'GOOGLE_PROJECT_SCOPES': '[]',
+        'YOUR_EMAIL': 'benchmark@example.com',
+        'UPLOAD_SESSIONS_PATH': os.path.join(work_dir, 'upload_sessions.json'),
+        'RUN_JOURNAL_DIR': os.path.join(work_dir, 'journal'),
+        'DRIVE_INDEX_DIR': os.path.join(work_dir, 'drive_index'),
+        'MENU_CACHE_DIR': os.path.join(work_dir, 'menu_cache'),
+        'TRACE_DIR': os.path.join(work_dir, 'traces'),
+        'MENU_CACHE_ENABLED': 'true' if args.cache else 'false',
+        'UPLOAD_CHUNK_SIZE_KB': str(args.chunk_kb),
+        'ASYNC_HTTP_ENABLED': 'true' if args.async_http else 'false',
+    })
+    os.environ.pop('FORM_TEMPLATE_ID', None)
+
+def add_template(client_factory):
+    """Stores a template form laid out like a generated one and returns its ID."""
+    items = []
+    for day in DAYS:
+        items.append({'title': ' ', 'imageItem': {'image': {'sourceUri': 'https://drive.google.com/uc?id=template'}}})
+        for course in ('soup', 'main course'):
+            items.append({'title': f'Choose your {course} for {day}:', 'questionItem': {'question': {
+                'required': course != 'soup',
+                'choiceQuestion': {'type': 'RADIO', 'options': [{'value': 'Option'}]}}}})
+    return client_factory.forms.add_form('Meals Order Template', items)
+
+def load_config():
+    """Loads Config the way the bundled app does, so app/assets/prompt.txt is found from the repo."""
+    from app.core.config import Config
+    sys.frozen, sys._MEIPASS = True, PROJECT_ROOT
+    try:
+        return Config()
+    finally:
+        del sys.frozen, sys._MEIPASS
+
+def generate_images(image_dir, size, seed=0):
+    """Writes one noisy JPEG per weekday; noise keeps the files close to real photo sizes."""
+    from PIL import Image
+    rng = random.Random(seed)
+    os.makedirs(image_dir, exist_ok=True)
+    paths = {}
+    for day in DAYS:
+        image = Image.frombytes('RGB', (size, size), rng.randbytes(size * size * 3))
+        paths[day] = os.path.join(image_dir, f"{day}.jpg")
+        image.save(paths[day], 'JPEG', quality=90)
+    return paths
+
+def run_once(args, work_dir):
+    """Runs one week against fresh fakes and returns the report."""
+    configure_environment(work_dir, args)
+    from app.script_runner import ScriptRunner
+
+    backend = FakeBackend({
+        'drive': ApiProfile(latency=args.drive_latency, error_rate=args.error_rate),
+        'forms': ApiProfile(latency=args.forms_latency, error_rate=args.error_rate),
+        'gemini': ApiProfile(latency=args.gemini_latency, error_rate=args.error_rate,
+                             quota_per_minute=args.gemini_quota),
+    }, seed=args.seed)
+    client_factory = FakeClientFactory(backend, lost_upload_responses=1 if args.async_http else 0)
+    model = FakeGenerativeModel(backend)
+    if args.template:
+        os.environ['FORM_TEMPLATE_ID'] = add_template(client_factory)
+
+    class BenchmarkRunner(ScriptRunner):
+        async def initialize_helpers(self):
+            await super().initialize_helpers()
+            self.gemini_helper.model = model
+
+    images = generate_images(os.path.join(work_dir, 'images'), args.image_size, seed=args.seed)
+    config = load_config()
+    if args.async_http:
+        from app.core.auth import get_credential_manager
+        # The async client takes its token from the process-wide manager, not from the runner
+        get_credential_manager(config).credentials = FakeCredentials()
+    runner = BenchmarkRunner(config, credentials=object(), client_factory=client_factory)
+    handler = QuietHandler()
+    start = time.perf_counter()
+    asyncio.run(runner.run_script(images, handler, week_number=args.week))
+    seconds = time.perf_counter() - start
+    if runner.status != 'completed':
+        print("\n".join(handler.messages), file=sys.stderr)
+    return {
+        'status': runner.status,
+        'error': runner.error,
+        'seconds': round(seconds, 3),
+        'stages': runner.stage_timings,
+        'peak_rss_mb': runner.peak_rss_mb,
+        'api': backend.stats.as_dict(),
+    }
+
+def compare(report, baseline, threshold):
+    """Returns the regressions of report against baseline as readable lines."""
+    regressions = []
+    if report['seconds'] > baseline['seconds'] * (1 + threshold):
+        regressions.append(f"wall time {report['seconds']:.3f}s > baseline {baseline['seconds']:.3f}s")
+    for api, calls in report['api']['calls_per_api'].items():
+        before = baseline['api']['calls_per_api'].get(api, 0)
+        if calls > before * (1 + threshold):
+            regressions.append(f"{api} calls {calls} > baseline {before}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--week', type=int, default=1, help='week number to build (default: 1)')
+    parser.add_argument('--image-size', type=int, default=1600, help='side of the generated images in px')
+    parser.add_argument('--chunk-kb', type=int, default=256, help='upload chunk size in KB (default: 256)')
+    parser.add_argument('--drive-latency', type=float, default=0.05, help='seconds per Drive call')
+    parser.add_argument('--forms-latency', type=float, default=0.1, help='seconds per Forms call')
+    parser.add_argument('--gemini-latency', type=float, default=1.0, help='seconds per Gemini call')
+    parser.add_argument('--gemini-quota', type=int, default=None, help='Gemini calls per minute before a 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls failing with a 503')
+    parser.add_argument('--cache', action='store_true', help='keep the menu cache enabled')
+    parser.add_argument('--template', action='store_true', help='copy a template form (FORM_TEMPLATE_ID)')
+    parser.add_argument('--async-http', action='store_true',
+                        help='send Drive and Forms calls through the httpx client (ASYNC_HTTP_ENABLED)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--save-baseline', help='write the report to this path')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed regression ratio (default: 0.2)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='flolunchmenu-e2e-') as work_dir:
+        report = run_once(args, work_dir)
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+    if report['status'] != 'completed':
+        return 1
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
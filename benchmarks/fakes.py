@@ -0,0 +1,711 @@
+"""In-process stand-ins for the Drive v3, Forms v1 and Gemini surfaces used by the helpers.
+
+They keep just enough state to run ScriptRunner end to end, sleep a configurable
+latency on every call, can inject transient errors and enforce a per-minute quota,
+and count calls and bytes per API. FakeRestApi serves the same Drive and Forms over
+REST for the async client; it needs httpx.
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+FORM_MIME_TYPE = 'application/vnd.google-apps.form'
+RESUME_INCOMPLETE = 308
+
+class FakeCredentials:
+    """Always-valid credentials for the process-wide credential manager of the async client."""
+
+    valid = True
+    expired = False
+    expiry = None
+    token = 'benchmark'
+    refresh_token = None
+
+class FakeResponse(dict):
+    """Looks like the httplib2 response carried by googleapiclient errors."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+        self.reason = 'Injected'
+
+class FakeHttpError(Exception):
+    """Raised like googleapiclient.errors.HttpError: the status is in resp.status."""
+
+    def __init__(self, status, retry_after=None):
+        headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+        self.resp = FakeResponse(status, headers)
+        super().__init__(f"<FakeHttpError {status}>")
+
+class FakeApiError(Exception):
+    """Raised like google.api_core errors: the status is in code."""
+
+    def __init__(self, code):
+        self.code = code
+        super().__init__(f"<FakeApiError {code}>")
+
+class ApiProfile:
+    """Latency, error and quota behaviour of one fake API."""
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, quota_per_minute=None, bytes_per_second=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.bytes_per_second = bytes_per_second
+
+class FakeStats:
+    """Thread-safe counters of calls, errors and bytes per API."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.bytes_in = defaultdict(int)
+        self.bytes_out = defaultdict(int)
+
+    def record(self, api, method, bytes_in=0, bytes_out=0):
+        with self.lock:
+            self.calls[f"{api}.{method}"] += 1
+            self.bytes_in[api] += bytes_in
+            self.bytes_out[api] += bytes_out
+
+    def record_error(self, api, status):
+        with self.lock:
+            self.errors[f"{api}.{status}"] += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'calls': dict(self.calls),
+                'calls_per_api': {api: sum(count for name, count in self.calls.items() if name.startswith(api + '.'))
+                                  for api in ('drive', 'forms', 'gemini')},
+                'errors': dict(self.errors),
+                'bytes_in': dict(self.bytes_in),
+                'bytes_out': dict(self.bytes_out),
+            }
+
+class FakeBackend:
+    """Shared state and call accounting for every fake service."""
+
+    def __init__(self, profiles=None, stats=None, seed=0):
+        self.profiles = profiles or {}
+        self.stats = stats or FakeStats()
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.quota_windows = defaultdict(list)
+        self.ids = itertools.count(1)
+
+    def new_id(self, prefix):
+        return f"{prefix}{next(self.ids):06d}"
+
+    def call(self, api, method, handler, bytes_in=0):
+        """Simulates one HTTP round trip: quota, latency, injected errors, then the handler."""
+        profile = self.profiles.get(api, ApiProfile())
+        now = time.monotonic()
+        with self.lock:
+            if profile.quota_per_minute:
+                window = [t for t in self.quota_windows[api] if now - t < 60]
+                self.quota_windows[api] = window
+                if len(window) >= profile.quota_per_minute:
+                    self.stats.record(api, method)
+                    self.stats.record_error(api, 429)
+                    raise self._error(api, 429, retry_after=max(0.0, 60 - (now - window[0])))
+                window.append(now)
+            inject = self.random.random() < profile.error_rate
+        delay = profile.latency + (self.random.uniform(0, profile.jitter) if profile.jitter else 0)
+        if profile.bytes_per_second and bytes_in:
+            delay += bytes_in / profile.bytes_per_second
+        time.sleep(delay)
+        if inject:
+            self.stats.record(api, method, bytes_in=bytes_in)
+            self.stats.record_error(api, 503)
+            raise self._error(api, 503)
+        result, bytes_out = handler()
+        self.stats.record(api, method, bytes_in=bytes_in, bytes_out=bytes_out)
+        return result
+
+    @staticmethod
+    def _error(api, status, retry_after=None):
+        if api == 'gemini':
+            return FakeApiError(status)
+        return FakeHttpError(status, retry_after=retry_after)
+
+class FakeRequest:
+    """Deferred call with the execute() surface of googleapiclient.http.HttpRequest."""
+
+    def __init__(self, backend, api, method, handler, bytes_in=0, bytes_out=None):
+        self.backend = backend
+        self.api = api
+        self.method = method
+        self.handler = handler
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out or (lambda result: 0)
+
+    def execute(self, http=None, num_retries=0):
+        def handler():
+            result = self.handler()
+            return result, self.bytes_out(result)
+        return self.backend.call(self.api, self.method, handler, bytes_in=self.bytes_in)
+
+class FakeMediaProgress:
+    def __init__(self, resumable_progress, total_size):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self):
+        return self.resumable_progress / self.total_size if self.total_size else 1.0
+
+class FakeUploadRequest:
+    """Resumable media upload with the next_chunk() surface of HttpRequest."""
+
+    def __init__(self, backend, media, on_complete):
+        self.backend = backend
+        self.media = media
+        self.resumable = media
+        self.on_complete = on_complete
+        self.resumable_uri = None
+        self.resumable_progress = 0
+        self.digest = hashlib.md5()
+
+    def next_chunk(self, http=None, num_retries=0):
+        total = self.media.size()
+        if self.resumable_uri is None:
+            self.resumable_uri = self.backend.call(
+                'drive', 'upload.start', lambda: (f"https://fake.upload/{self.backend.new_id('session')}", 0))
+        chunk_size = self.media.chunksize() if self.media.chunksize() > 0 else total
+        data = self.media.getbytes(self.resumable_progress, min(chunk_size, total - self.resumable_progress))
+
+        def handler():
+            self.digest.update(data)
+            self.resumable_progress += len(data)
+            if self.resumable_progress >= total:
+                return (None, self.on_complete(total, self.digest.hexdigest())), 0
+            return (FakeMediaProgress(self.resumable_progress, total), None), 0
+
+        return self.backend.call('drive', 'upload.chunk', handler, bytes_in=len(data))
+
+    def execute(self, http=None, num_retries=0):
+        response = None
+        while response is None:
+            _, response = self.next_chunk()
+        return response
+
+class FakeBatch:
+    """Sends the added requests as one round trip, like BatchHttpRequest."""
+
+    def __init__(self, backend, callback=None):
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests) + 1), request, callback or self.callback))
+
+    def execute(self, http=None):
+        def handler():
+            results = []
+            for request_id, request, _ in self.requests:
+                try:
+                    results.append((request_id, request.handler(), None))
+                except Exception as e:
+                    results.append((request_id, None, e))
+            return results, 0
+
+        results = self.backend.call('drive', 'batch', handler)
+        for (request_id, response, exception), (_, _, callback) in zip(results, self.requests):
+            if callback:
+                callback(request_id, response, exception)
+
+class _Resource:
+    def __init__(self, service):
+        self.service = service
+        self.backend = service.backend
+
+    def _request(self, method, handler, bytes_in=0, bytes_out=None):
+        return FakeRequest(self.backend, self.service.api, method, handler, bytes_in=bytes_in, bytes_out=bytes_out)
+
+class FakeDriveFiles(_Resource):
+    def _file(self, file_id):
+        if file_id == 'root':
+            return self.service.root
+        file = self.service.store.get(file_id)
+        if file is None:
+            raise FakeHttpError(404)
+        return file
+
+    def list(self, q='', fields=None, pageSize=100, pageToken=None, **kwargs):
+        def handler():
+            with self.backend.lock:
+                matches = [f for f in self.service.store.values() if self.service.matches(f, q)]
+            start = int(pageToken or 0)
+            page = matches[start:start + pageSize]
+            response = {'files': [dict(f) for f in page]}
+            if start + pageSize < len(matches):
+                response['nextPageToken'] = str(start + pageSize)
+            return response
+        return self._request('files.list', handler)
+
+    def get(self, fileId, fields=None, **kwargs):
+        def handler():
+            with self.backend.lock:
+                file = dict(self._file(fileId))
+            file['webViewLink'] = f"https://docs.google.com/fake/{fileId}"
+            return file
+        return self._request('files.get', handler)
+
+    def get_media(self, fileId, **kwargs):
+        def handler():
+            with self.backend.lock:
+                size = int(self._file(fileId).get('size', 0))
+            return b'\xff\xd8' + b'\0' * max(0, size - 2)
+        return self._request('files.get_media', handler, bytes_out=len)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        body = dict(body or {})
+
+        def store(size=None, md5=None):
+            with self.backend.lock:
+                file_id = self.service.add(body.get('name'), body.get('mimeType', 'application/octet-stream'),
+                                           body.get('parents', []), size=size, md5=md5)
+            return {'id': file_id}
+
+        if media_body is not None and getattr(media_body, 'resumable', lambda: False)():
+            return FakeUploadRequest(self.backend, media_body, store)
+        if media_body is not None:
+            data = media_body.getbytes(0, media_body.size())
+            return self._request('files.create', lambda: store(len(data), hashlib.md5(data).hexdigest()),
+                                 bytes_in=len(data))
+        return self._request('files.create', store)
+
+    def update(self, fileId, body=None, media_body=None, addParents=None, removeParents=None, fields=None,
+               **kwargs):
+        if media_body is not None and getattr(media_body, 'resumable', lambda: False)():
+            def replace(size, md5):
+                with self.backend.lock:
+                    file = self._file(fileId)
+                    file.update(body or {}, size=str(size), md5Checksum=md5)
+                    self.service.log_change(fileId)
+                    return {'id': fileId}
+            return FakeUploadRequest(self.backend, media_body, replace)
+        data = media_body.getbytes(0, media_body.size()) if media_body is not None else b''
+
+        def handler():
+            with self.backend.lock:
+                file = self._file(fileId)
+                file.update(body or {})
+                if removeParents:
+                    file['parents'] = [p for p in file['parents'] if p not in removeParents.split(',')]
+                if addParents:
+                    file['parents'] = file['parents'] + addParents.split(',')
+                if media_body is not None:
+                    file['size'] = str(len(data))
+                    file['md5Checksum'] = hashlib.md5(data).hexdigest()
+                self.service.log_change(fileId)
+                return dict(file)
+        return self._request('files.update', handler, bytes_in=len(data))
+
+    def copy(self, fileId, body=None, fields=None, **kwargs):
+        def handler():
+            with self.backend.lock:
+                source = self._file(fileId)
+                body_ = dict(body or {})
+                file_id = self.service.add(body_.get('name', source['name']), source['mimeType'],
+                                           body_.get('parents', []), size=source.get('size'),
+                                           md5=source.get('md5Checksum'))
+                if source['mimeType'] == FORM_MIME_TYPE and fileId in self.service.forms_backend.form_map:
+                    self.service.forms_backend.copy_form(fileId, file_id)
+            return {'id': file_id}
+        return self._request('files.copy', handler)
+
+class FakeDriveChanges(_Resource):
+    def getStartPageToken(self, **kwargs):
+        return self._request('changes.getStartPageToken',
+                             lambda: {'startPageToken': str(len(self.service.change_log))})
+
+    def list(self, pageToken, pageSize=100, fields=None, **kwargs):
+        def handler():
+            with self.backend.lock:
+                start = int(pageToken)
+                page = self.service.change_log[start:start + pageSize]
+                changes = []
+                for file_id in page:
+                    file = self.service.store.get(file_id)
+                    changes.append({'fileId': file_id, 'removed': file is None, 'file': dict(file or {})})
+                response = {'changes': changes}
+                if start + pageSize < len(self.service.change_log):
+                    response['nextPageToken'] = str(start + pageSize)
+                else:
+                    response['newStartPageToken'] = str(len(self.service.change_log))
+                return response
+        return self._request('changes.list', handler)
+
+class FakeDrivePermissions(_Resource):
+    def create(self, fileId, body=None, fields=None, **kwargs):
+        return self._request('permissions.create', lambda: {'id': self.backend.new_id('perm')})
+
+class FakeDriveService:
+    """Drive v3 stand-in: files, changes, permissions and batch requests."""
+
+    api = 'drive'
+
+    def __init__(self, backend, forms_backend=None):
+        self.backend = backend
+        self.forms_backend = forms_backend
+        self.root = {'id': 'root-folder', 'name': 'My Drive', 'mimeType': FOLDER_MIME_TYPE, 'parents': []}
+        self.store = {}
+        self.change_log = []
+
+    def add(self, name, mime_type, parents, file_id=None, size=None, md5=None):
+        file_id = file_id or self.backend.new_id('file')
+        self.store[file_id] = {'id': file_id, 'name': name, 'mimeType': mime_type,
+                               'parents': list(parents) or [self.root['id']], 'trashed': False}
+        if size is not None:
+            self.store[file_id]['size'] = str(size)
+        if md5 is not None:
+            self.store[file_id]['md5Checksum'] = md5
+        self.log_change(file_id)
+        return file_id
+
+    def log_change(self, file_id):
+        self.change_log.append(file_id)
+
+    def matches(self, file, query):
+        """Evaluates the subset of the Drive query language used by the helpers."""
+        for clause in query.split(' and '):
+            clause = clause.strip()
+            if not clause:
+                continue
+            match = re.fullmatch(r"(\w+)\s*=\s*'(.*)'", clause)
+            if match:
+                if str(file.get(match.group(1))) != match.group(2):
+                    return False
+                continue
+            match = re.fullmatch(r"'(.*)' in parents", clause)
+            if match:
+                if match.group(1) not in file.get('parents', []):
+                    return False
+                continue
+            if clause == 'trashed=false' and file.get('trashed'):
+                return False
+        return True
+
+    def files(self):
+        return FakeDriveFiles(self)
+
+    def changes(self):
+        return FakeDriveChanges(self)
+
+    def permissions(self):
+        return FakeDrivePermissions(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.backend, callback)
+
+class FakeForms(_Resource):
+    def create(self, body=None, **kwargs):
+        def handler():
+            with self.backend.lock:
+                form_id = self.service.drive.add((body or {}).get('info', {}).get('title', 'Untitled form'),
+                                                 FORM_MIME_TYPE, [])
+                self.service.form_map[form_id] = {'formId': form_id, 'info': dict((body or {}).get('info', {})),
+                                               'items': [], 'responderUri': f"https://forms.fake/{form_id}"}
+                return dict(self.service.form_map[form_id])
+        return self._request('forms.create', handler)
+
+    def get(self, formId, **kwargs):
+        def handler():
+            with self.backend.lock:
+                form = self.service.form_map.get(formId)
+                if form is None:
+                    raise FakeHttpError(404)
+                return json.loads(json.dumps(form))
+        return self._request('forms.get', handler)
+
+    def batchUpdate(self, formId, body=None, **kwargs):
+        payload = json.dumps(body or {})
+
+        def handler():
+            with self.backend.lock:
+                form = self.service.form_map.get(formId)
+                if form is None:
+                    raise FakeHttpError(404)
+                replies = []
+                for request in (body or {}).get('requests', []):
+                    replies.append(self.service.apply(form, request))
+                return {'form': json.loads(json.dumps(form)), 'replies': replies}
+        return self._request('forms.batchUpdate', handler, bytes_in=len(payload))
+
+class FakeFormsService:
+    """Forms v1 stand-in: create, get and the batchUpdate requests the app sends."""
+
+    api = 'forms'
+
+    def __init__(self, backend, drive):
+        self.backend = backend
+        self.drive = drive
+        drive.forms_backend = self
+        self.form_map = {}
+
+    def add_form(self, title, items):
+        """Stores a form directly, e.g. a template for the runs to copy, and returns its ID."""
+        form_id = self.drive.add(title, FORM_MIME_TYPE, [])
+        self.form_map[form_id] = {'formId': form_id, 'info': {'title': title}, 'items': [],
+                                  'responderUri': f"https://forms.fake/{form_id}"}
+        for index, item in enumerate(items):
+            self.apply(self.form_map[form_id], {'createItem': {'item': item, 'location': {'index': index}}})
+        return form_id
+
+    def copy_form(self, source_id, form_id):
+        form = json.loads(json.dumps(self.form_map[source_id]))
+        form['formId'] = form_id
+        form['responderUri'] = f"https://forms.fake/{form_id}"
+        for item in form['items']:
+            item['itemId'] = self.backend.new_id('item')
+        self.form_map[form_id] = form
+
+    def apply(self, form, request):
+        items = form['items']
+        if 'createItem' in request:
+            item = dict(request['createItem']['item'], itemId=self.backend.new_id('item'))
+            question = item.get('questionItem', {}).get('question')
+            if question is not None:
+                question['questionId'] = self.backend.new_id('question')
+            items.insert(request['createItem']['location']['index'], item)
+            return {'createItem': {'itemId': item['itemId']}}
+        if 'deleteItem' in request:
+            del items[request['deleteItem']['location']['index']]
+            return {}
+        if 'updateItem' in request:
+            index = request['updateItem']['location']['index']
+            items[index].update(request['updateItem']['item'])
+            return {}
+        if 'updateFormInfo' in request:
+            form['info'].update(request['updateFormInfo']['info'])
+            return {}
+        raise FakeHttpError(400)
+
+    def forms(self):
+        return FakeForms(self)
+
+class FakeHttp:
+    """Authorized transport stand-in; answers the status query of a saved upload session."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        # The fake server keeps no bytes of earlier sessions, so a resumed upload starts from 0
+        return self.backend.call('drive', 'upload.status', lambda: ((FakeResponse(308), b''), 0))
+
+class FakeRestApi:
+    """The Drive v3 and Forms v1 REST endpoints of the fake services, behind an httpx.MockTransport.
+
+    Requests go to the same services as the googleapiclient surface, so both clients see
+    one Drive. Resumable upload sessions count the bytes received, so the status query
+    reports the real offset. The responses to the first lost_upload_responses chunks are
+    dropped after the chunk was stored, like on a broken connection, so the client has
+    to ask where to resume.
+    """
+
+    def __init__(self, backend, drive, forms, lost_upload_responses=0):
+        self.backend = backend
+        self.drive = drive
+        self.forms = forms
+        self.lost_upload_responses = lost_upload_responses
+        self.sessions = {}
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request):
+        # The services sleep their latency, so they run off the event loop like a real server
+        try:
+            status, body, headers = await asyncio.to_thread(self._route, request)
+        except FakeHttpError as e:
+            status, body, headers = e.resp.status, {'error': {'code': e.resp.status}}, dict(e.resp)
+        if status is None:
+            raise httpx.ReadError("Connection lost before the response", request=request)
+        return httpx.Response(status, json=body, headers=headers)
+
+    def _route(self, request):
+        path = request.url.path
+        params = dict(request.url.params)
+        body = json.loads(request.content) if request.headers.get('content-type') == 'application/json' else None
+        if request.url.host == 'fake.upload':
+            return self._upload_chunk(path.rsplit('/', 1)[1], request)
+        if path.startswith('/upload/drive/v3/files'):
+            return self._upload_start(path[len('/upload/drive/v3/files'):].lstrip('/'), request, body)
+        if path.startswith('/drive/v3/files'):
+            return 200, self._drive(request.method, path[len('/drive/v3/files'):], params, body).execute(), {}
+        if path.startswith('/v1/forms'):
+            return 200, self._forms(request.method, path[len('/v1/forms'):], body).execute(), {}
+        raise FakeHttpError(404)
+
+    def _drive(self, method, path, params, body):
+        files = self.drive.files()
+        if not path:
+            if method == 'GET':
+                return files.list(q=params.get('q', ''), pageSize=int(params.get('pageSize', 100)),
+                                  pageToken=params.get('pageToken'))
+            return files.create(body=body)
+        file_id = path.lstrip('/')
+        if file_id.endswith('/copy'):
+            return files.copy(file_id[:-len('/copy')], body=body)
+        if method == 'PATCH':
+            return files.update(file_id, body=body, addParents=params.get('addParents'),
+                                removeParents=params.get('removeParents'))
+        return files.get(file_id)
+
+    def _forms(self, method, path, body):
+        forms = self.forms.forms()
+        if not path:
+            return forms.create(body=body)
+        form_id = path.lstrip('/')
+        if form_id.endswith(':batchUpdate'):
+            return forms.batchUpdate(form_id[:-len(':batchUpdate')], body=body)
+        return forms.get(form_id)
+
+    def _upload_start(self, file_id, request, metadata):
+        def handler():
+            with self.backend.lock:
+                session_id = self.backend.new_id('session')
+                self.sessions[session_id] = {
+                    'file_id': file_id or None, 'metadata': metadata or {}, 'received': 0, 'result': None,
+                    'total': int(request.headers['x-upload-content-length']), 'digest': hashlib.md5(),
+                }
+            return session_id, 0
+
+        session_id = self.backend.call('drive', 'upload.start', handler)
+        return 200, None, {'Location': f"https://fake.upload/{session_id}"}
+
+    def _upload_chunk(self, session_id, request):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise FakeHttpError(404)
+        content_range = request.headers['content-range'][len('bytes '):]
+        if content_range.startswith('*'):
+            return self.backend.call('drive', 'upload.status', lambda: (self._upload_progress(session), 0))
+        data = request.content
+
+        def handler():
+            with self.backend.lock:
+                if int(content_range.split('-', 1)[0]) != session['received']:
+                    raise FakeHttpError(400)
+                session['digest'].update(data)
+                session['received'] += len(data)
+                if session['received'] >= session['total']:
+                    session['result'] = self._store_upload(session)
+                return self._upload_progress(session), 0
+
+        result = self.backend.call('drive', 'upload.chunk', handler, bytes_in=len(data))
+        with self.backend.lock:
+            if self.lost_upload_responses > 0:
+                self.lost_upload_responses -= 1
+                return None, None, {}
+        return result
+
+    def _upload_progress(self, session):
+        """The reply to a chunk or a status query: 308 with the range received, or the finished file."""
+        if session['result'] is not None:
+            return 200, session['result'], {}
+        received = session['received']
+        return RESUME_INCOMPLETE, None, {'Range': f"bytes=0-{received - 1}"} if received else {}
+
+    def _store_upload(self, session):
+        size, md5 = session['total'], session['digest'].hexdigest()
+        file_id = session['file_id']
+        if file_id:
+            file = self.drive.store.get(file_id)
+            if file is None:
+                raise FakeHttpError(404)
+            file.update(session['metadata'], size=str(size), md5Checksum=md5)
+            self.drive.log_change(file_id)
+        else:
+            metadata = session['metadata']
+            file_id = self.drive.add(metadata.get('name'), metadata.get('mimeType', 'application/octet-stream'),
+                                     metadata.get('parents', []), size=size, md5=md5)
+        return {'id': file_id}
+
+class FakeClientFactory:
+    """Hands out the fake services through the GoogleClientFactory surface."""
+
+    def __init__(self, backend, lost_upload_responses=0):
+        self.drive = FakeDriveService(backend)
+        self.forms = FakeFormsService(backend, self.drive)
+        self.services = {('drive', 'v3'): self.drive, ('forms', 'v1'): self.forms}
+        self.timings = {}
+        self.backend = backend
+        self.rest = FakeRestApi(backend, self.drive, self.forms, lost_upload_responses=lost_upload_responses)
+
+    def http(self):
+        return FakeHttp(self.backend)
+
+    def async_transport(self):
+        return self.rest.transport()
+
+    def get(self, service_name, version):
+        return self.services[(service_name, version)]
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+class _Candidate:
+    def __init__(self, text):
+        self.content = type('Content', (), {'parts': [_Part(text)]})()
+
+class FakeGeminiResponse:
+    def __init__(self, text, prompt_tokens, output_tokens):
+        self.text = text
+        self.candidates = [_Candidate(text)]
+        self.prompt_feedback = None
+        self.usage_metadata = type('Usage', (), {
+            'prompt_token_count': prompt_tokens,
+            'candidates_token_count': output_tokens,
+            'total_token_count': prompt_tokens + output_tokens,
+        })()
+
+class FakeGenerativeModel:
+    """generate_content stand-in returning a plausible menu per image, optionally streamed."""
+
+    DISHES = ['Minestrone', 'Lentil soup', 'Lasagne', 'Grilled chicken', 'Vegetable curry', 'Fish and chips']
+
+    def __init__(self, backend, per_image_latency=0.0):
+        self.backend = backend
+        self.per_image_latency = per_image_latency
+
+    def _menu(self, seed):
+        rng = random.Random(seed)
+        return [{'name': f"{name} {seed % 97}", 'allergens': f"({rng.randint(1, 14)})"} for name in self.DISHES]
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        images = [part for part in contents if isinstance(part, dict) and 'data' in part]
+        labels = [part.rstrip(':') for part in contents if isinstance(part, str) and part.endswith(':')]
+        bytes_in = sum(len(part['data']) for part in images)
+
+        def handler():
+            time.sleep(self.per_image_latency * len(images))
+            menus = [self._menu(int(hashlib.md5(part['data']).hexdigest()[:8], 16)) for part in images]
+            if labels and len(labels) == len(menus):
+                text = json.dumps(dict(zip(labels, menus)))
+            else:
+                text = json.dumps(menus[0] if menus else [])
+            return FakeGeminiResponse(text, 258 * len(images) + 200, len(text) // 4), len(text)
+
+        response = self.backend.call('gemini', 'generate_content', handler, bytes_in=bytes_in)
+        if not stream:
+            return response
+        return [FakeGeminiResponse(response.text[i:i + 64], 0, 0) for i in range(0, len(response.text), 64)]
@@ -0,0 +1,66 @@
+"""Startup-time benchmark for the Tk entry point.
+
+Imports a module in a fresh interpreter with ``-X importtime`` and reports the
+cumulative import time of the heaviest modules. Exits with status 1 when the
+total exceeds the budget or when one of the deferred SDKs is imported eagerly.
+
+    python benchmarks/startup.py                  # ui.py against the default budget
+    python benchmarks/startup.py --module app.script_runner --budget-ms 0
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported once "Generate Form" is pressed or in the warm-up thread
+DEFERRED_MODULES = ('google.generativeai', 'googleapiclient', 'google_auth_oauthlib', 'PIL')
+
+def measure_imports(module):
+    """Returns a list of (module, self_us, cumulative_us) for a cold import of module."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='ui', help='module to import (default: ui)')
+    parser.add_argument('--budget-ms', type=float, default=300,
+                        help='maximum cumulative import time, 0 to disable (default: 300)')
+    parser.add_argument('--top', type=int, default=15, help='number of modules to report (default: 15)')
+    args = parser.parse_args()
+
+    timings = measure_imports(args.module)
+    # Top-level entries (a single space after the separator) add up to the total import time
+    total_us = sum(cumulative for name, _, cumulative in timings if not name.startswith('  '))
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us in sorted(timings, key=lambda t: t[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name.strip()}")
+    print(f"\nTotal import time of {args.module}: {total_us / 1000:.1f} ms")
+
+    failed = False
+    names = {name.strip() for name, _, _ in timings}
+    eager = sorted(name for name in names
+                   if any(name == module or name.startswith(module + '.') for module in DEFERRED_MODULES))
+    if args.module == 'ui' and eager:
+        print(f"FAIL: deferred modules imported at startup: {', '.join(eager[:5])}")
+        failed = True
+    if args.budget_ms and total_us / 1000 > args.budget_ms:
+        print(f"FAIL: {total_us / 1000:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
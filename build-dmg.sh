@@ -12,6 +12,7 @@ pyinstaller --onefile --windowed \
   --add-data "app/assets:app/assets" \
   --add-data "app/core/credentials.json:app/core" \
   --add-data ".env:." \
+  --collect-data googleapiclient \
   --name "$APP_NAME" \
   --icon="$ICON_FILE" \
   "$PROJECT_ROOT/ui.py"
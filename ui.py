@@ -2,32 +2,89 @@ import tkinter as tk
 from tkinter import Y, scrolledtext, filedialog, ttk
 from threading import Thread
 import asyncio
+import multiprocessing
+import queue
 from pathlib import Path
 from app.core.config import Config
-from app.script_runner import ScriptRunner, ScriptRunnerError
-from PIL import Image, ImageTk
 import os
 import sys
 
+# The log and progress bar are redrawn at most this often, in milliseconds
+UI_FRAME_MS = 50
+# Events applied per frame, so a burst of messages can't freeze the window
+MAX_EVENTS_PER_FRAME = 500
+# Lines kept in the process log
+MAX_LOG_LINES = 1000
+
 class ApplicationUI(tk.Frame):
-    def __init__(self, master=None, script_runner=None):
+    def __init__(self, master=None, script_runner=None, config=None):
         super().__init__(master)
         self.master = master
         self.master.title("Weekly Meal Order Form Generator")
         self.pack(padx=20, pady=20)
         self.script_runner = script_runner
+        self.app_config = config
         self.selected_image_paths = {
             day: {'path': None, 'label_var': None, 'label': None}
             for day in ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
         }
         self.progress_var = tk.IntVar(value=0)
         self.logo_image = None  # Initialize to None
-        self.load_logo()
+        self.logo_label = None
+        # Worker threads only ever put events here; the Tk thread applies them in pump_events
+        self.events = queue.SimpleQueue()
         self.create_widgets()
+        self.after(UI_FRAME_MS, self.pump_events)
+        # Defer the logo (Pillow) and the Google SDKs until the window is on screen
+        self.after_idle(self.load_logo)
+        self.after_idle(self.warm_up_in_background)
+        # Days whose image was picked by the folder watcher rather than by hand
+        self.watched_days = set()
+        if self.app_config is not None and self.app_config.WATCH_DIR:
+            self.after_idle(self.start_watching)
+
+    def warm_up_in_background(self):
+        """Imports the script runner and its SDKs in a background thread."""
+        Thread(target=self._import_script_runner, daemon=True).start()
+
+    def _import_script_runner(self):
+        try:
+            import app.script_runner  # noqa: F401
+        except Exception as e:
+            print(f"Error preloading script runner: {e}")
+
+    def start_watching(self):
+        """Prepares the images dropped in WATCH_DIR in the background and fills in the days."""
+        Thread(target=self._run_watcher, daemon=True).start()
+
+    def _run_watcher(self):
+        try:
+            from datetime import datetime
+            from app.watcher import MenuPrefetcher
+            week = datetime.now().isocalendar()[1]
+
+            def on_image(day, path, image_week):
+                # Generate Form builds the current week, so only its images are filled in
+                if image_week == week:
+                    self.events.put(('prefill', day, Path(path)))
+
+            prefetcher = MenuPrefetcher(self.app_config, self)
+            asyncio.run(prefetcher.watch(self.app_config.WATCH_DIR, week_number=week,
+                                         interval=self.app_config.WATCH_INTERVAL_SECONDS, on_image=on_image))
+        except Exception as e:
+            self.log_message(f"Stopped watching {self.app_config.WATCH_DIR}: {e}", error=True)
+
+    def get_script_runner(self):
+        """Returns the script runner, creating it on first use."""
+        if self.script_runner is None:
+            from app.script_runner import ScriptRunner
+            self.script_runner = ScriptRunner(self.app_config)
+        return self.script_runner
 
     def load_logo(self):
         """Loads and resizes the logo image."""
         try:
+            from PIL import Image, ImageTk
             if getattr(sys, 'frozen', False):
                 # If the application is run as a bundle, the PyInstaller bootloader
                 # extends the sys module by a flag frozen=True and sets the app
@@ -42,6 +99,8 @@ class ApplicationUI(tk.Frame):
             height = original_image.height * width // original_image.width
             resized_image = original_image.resize((width, height), Image.LANCZOS)
             self.logo_image = ImageTk.PhotoImage(resized_image)
+            if self.logo_label is not None:
+                self.logo_label.config(image=self.logo_image)
         except Exception as e:
             print(f"Error loading logo: {e}")
 
@@ -56,9 +115,8 @@ class ApplicationUI(tk.Frame):
         logo_frame = ttk.Frame(self)
         logo_frame.grid(row=0, column=1, sticky="nsew", padx=10, pady=10)
 
-        if self.logo_image:
-            logo_label = ttk.Label(logo_frame, image=self.logo_image)
-            logo_label.pack()
+        self.logo_label = ttk.Label(logo_frame)
+        self.logo_label.pack()
 
         # --- Upload Frame ---
         upload_frame = ttk.LabelFrame(self, text="Select Menu Images", padding=10)
@@ -96,6 +154,7 @@ class ApplicationUI(tk.Frame):
         output_frame.grid(row=3, column=0, sticky="nsew", padx=10, pady=10)
         self.output_text = scrolledtext.ScrolledText(output_frame, wrap=tk.WORD, font=("Courier New", 10), height=10)
         self.output_text.pack(expand=True, fill='both')
+        self.output_text.tag_config("error", foreground="red")
 
         # --- Exit Button ---
         self.exit_button = ttk.Button(self, text="Exit", command=self.master.destroy)
@@ -110,6 +169,7 @@ class ApplicationUI(tk.Frame):
             image_path = Path(filepath)
             self.selected_image_paths[day]['path'] = image_path
             self.selected_image_paths[day]['label_var'].set(image_path.name)
+            self.watched_days.discard(day)
 
     def run_script_in_thread(self):
         if not all(data['path'] for data in self.selected_image_paths.values()):
@@ -127,41 +187,83 @@ class ApplicationUI(tk.Frame):
         thread.start()
 
     def _run_async_script(self, image_paths):
+        from app.script_runner import ScriptRunnerError
         try:
-            asyncio.run(self.script_runner.run_script(image_paths, self))
+            asyncio.run(self.get_script_runner().run_script(image_paths, self))
         except ScriptRunnerError as e:
             self.log_message(str(e), error=True)
             self.enable_buttons()
 
     def log_message(self, message, error=False):
-        """Logs a message to the output widget and console."""
+        """Queues a message for the output widget and logs it to the console; safe from any thread."""
         print(message)  # Keep console logging for debugging
-        self.output_text.insert(tk.END, message + "\n")
-        if error:
-            self.output_text.tag_add("error", "end -2 lines", "end -1 lines")
-            self.output_text.tag_config("error", foreground="red")
-        self.output_text.see(tk.END)  # Scroll to the end
+        self.events.put(('log', message, error))
 
     def update_progress(self, value):
-        self.progress_var.set(value)
+        """Queues a progress value; only the latest one of each frame is drawn."""
+        self.events.put(('progress', value))
 
     def enable_buttons(self):
-        self.start_button.config(state=tk.NORMAL)
-        self.clear_button.config(state=tk.NORMAL)
+        self.events.put(('enable',))
+
+    def pump_events(self):
+        """Applies the queued events on the Tk thread: one insert for all new lines, one progress update."""
+        log_args = []
+        progress = None
+        enable = False
+        for _ in range(MAX_EVENTS_PER_FRAME):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == 'log':
+                log_args.extend((event[1] + "\n", ("error",) if event[2] else ()))
+            elif event[0] == 'progress':
+                progress = event[1]
+            elif event[0] == 'enable':
+                enable = True
+            elif event[0] == 'prefill':
+                self.prefill_image(event[1], event[2])
+
+        if log_args:
+            self.output_text.insert(tk.END, *log_args)
+            self.trim_log()
+            self.output_text.see(tk.END)  # Scroll to the end
+        if progress is not None:
+            self.progress_var.set(progress)
+        if enable:
+            self.start_button.config(state=tk.NORMAL)
+            self.clear_button.config(state=tk.NORMAL)
+        self.after(UI_FRAME_MS, self.pump_events)
+
+    def prefill_image(self, day, image_path):
+        """Selects an image found by the folder watcher, unless one was picked by hand."""
+        day_data = self.selected_image_paths[day]
+        if day_data['path'] is not None and day not in self.watched_days:
+            return
+        day_data['path'] = image_path
+        day_data['label_var'].set(f"{image_path.name} (from watch folder)")
+        self.watched_days.add(day)
+
+    def trim_log(self):
+        """Drops the oldest lines beyond MAX_LOG_LINES."""
+        lines = int(self.output_text.index('end-1c').split('.')[0]) - 1
+        if lines > MAX_LOG_LINES:
+            self.output_text.delete('1.0', f'{lines - MAX_LOG_LINES + 1}.0')
 
     def clear_form(self):
         """Resets the form to its initial state."""
         for day_data in self.selected_image_paths.values():
             day_data['path'] = None
             day_data['label_var'].set("No file selected")
+        self.watched_days.clear()
         self.output_text.delete('1.0', tk.END)
         self.progress_var.set(0)
 
 def main():
     root = tk.Tk()
     config = Config()
-    script_runner = ScriptRunner(config)
-    app_ui = ApplicationUI(master=root, script_runner=script_runner)
+    app_ui = ApplicationUI(master=root, config=config)
 
     # Redirect stderr to a file
     error_log_path = os.path.join(os.path.expanduser("~"), "flo_app_error.log")
@@ -170,4 +272,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # Image preprocessing uses a process pool, which needs this in the bundled app
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file